@@ -0,0 +1,466 @@
+import json
+import os
+import zlib
+from functools import wraps
+from flask import Blueprint, Response, jsonify, make_response, request, send_file, url_for
+from models import db, Product, Location, ProductMovement, StockBalance, Job
+from stock import ledger_version
+from importer import detect_format, parse_record
+from queries import movement_query, encode_cursor
+from lookups import search_names
+import movements
+import jobs
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MAX_BATCH = int(os.environ.get('API_MAX_BATCH', 1000))
+MAX_PAGE = 1000
+
+
+def ledger_etag(view):
+    # reads are tagged with the ledger version, so a matching If-None-Match is answered
+    # from the cached version without running the view or querying the database
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        tag = f'{ledger_version()}-{zlib.crc32(request.full_path.encode()):08x}'
+        if request.if_none_match.contains(tag):
+            resp = Response(status=304)
+        else:
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code != 200:
+                return resp
+        resp.set_etag(tag)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+    return wrapper
+
+
+def error(message, status=400, **extra):
+    return jsonify(error=message, **extra), status
+
+
+def batch_errors(errors):
+    # nothing is written when any item is invalid
+    return jsonify(error='invalid items, nothing was written',
+                   errors=[{'index': i, 'error': e} for i, e in errors]), 400
+
+
+def _items():
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        body = body.get('items', [body])
+    if not isinstance(body, list) or not body:
+        raise ValueError('expected a JSON object, a list, or {"items": [...]}')
+    if len(body) > MAX_BATCH:
+        raise ValueError(f'at most {MAX_BATCH} items per request')
+    if not all(isinstance(item, dict) for item in body):
+        raise ValueError('every item must be a JSON object')
+    return body
+
+
+def _int(item, key, minimum=None, nullable=False):
+    value = item.get(key)
+    if value is None and nullable:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f'{key} must be an integer')
+    if minimum is not None and value < minimum:
+        raise ValueError(f'{key} must be at least {minimum}')
+    return value
+
+
+def _name(item):
+    name = item.get('name')
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError('name is required')
+    return name.strip()
+
+
+def _limit():
+    return max(1, min(request.args.get('limit', 100, type=int), MAX_PAGE))
+
+
+def _load(model, items):
+    ids = [item.get('id') for item in items]
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise ValueError('every item needs an integer id')
+    return {row.id: row for row in model.query.filter(model.id.in_(ids))}
+
+
+def _taken_names(model, names):
+    if not names:
+        return {}
+    return dict(db.session.query(model.name, model.id).filter(model.name.in_(names)))
+
+
+def _unknown_refs(items, refs, errors):
+    # refs: {key: model}; one IN (...) per model for the whole batch, skipping items already in error
+    bad = {i for i, _ in errors}
+    wanted = {}
+    for i, item in enumerate(items):
+        for key, model in refs.items():
+            if i not in bad and item.get(key) is not None:
+                wanted.setdefault(model, set()).add(item[key])
+    found = {model: {row_id for row_id, in db.session.query(model.id).filter(model.id.in_(ids))}
+             for model, ids in wanted.items()}
+    unknown = []
+    for i, item in enumerate(items):
+        for key, model in refs.items():
+            if i not in bad and item.get(key) is not None and item[key] not in found[model]:
+                unknown.append((i, f'unknown {model.__tablename__} id {item[key]}'))
+    return unknown
+
+
+def product_json(p):
+    return {'id': p.id, 'name': p.name, 'description': p.description,
+            'quantity': p.quantity, 'location_id': p.location_id}
+
+
+def location_json(loc):
+    return {'id': loc.id, 'name': loc.name, 'address': loc.address}
+
+
+def _check_names(model, items, existing_ids=None):
+    # unique within the batch and against rows that aren't the item itself
+    errors = []
+    names = {}
+    for i, item in enumerate(items):
+        if 'name' in item or existing_ids is None:
+            try:
+                names[i] = _name(item)
+            except ValueError as e:
+                errors.append((i, str(e)))
+    taken = _taken_names(model, list(names.values()))
+    seen = set()
+    for i, name in names.items():
+        own_id = items[i].get('id') if existing_ids is not None else None
+        if name in seen or taken.get(name, own_id) != own_id:
+            errors.append((i, f'name {name!r} is already used'))
+        seen.add(name)
+    return names, errors
+
+
+@api.route('/version')
+def version():
+    return jsonify(version=ledger_version())
+
+
+@api.route('/products')
+@ledger_etag
+def list_products():
+    after_id = request.args.get('after_id', 0, type=int)
+    rows = Product.query.filter(Product.id > after_id).order_by(Product.id).limit(_limit()).all()
+    return jsonify(items=[product_json(p) for p in rows],
+                   next_after_id=rows[-1].id if rows else None)
+
+
+def _search(model):
+    # type-ahead on the indexed name prefix, for forms too big for a <select>
+    prefix = request.args.get('q', '').strip()
+    if not prefix:
+        return jsonify(items=[])
+    rows = search_names(model, prefix, request.args.get('limit', 20, type=int))
+    return jsonify(items=[{'id': row_id, 'name': name} for row_id, name in rows])
+
+
+@api.route('/products/search')
+@ledger_etag
+def search_products():
+    return _search(Product)
+
+
+@api.route('/products/<int:id>')
+@ledger_etag
+def get_product(id):
+    p = db.session.get(Product, id)
+    if p is None:
+        return error('product not found', 404)
+    return jsonify(product_json(p))
+
+
+@api.route('/products', methods=['POST'])
+def create_products():
+    try:
+        items = _items()
+    except ValueError as e:
+        return error(str(e))
+    names, errors = _check_names(Product, items)
+    values = {}
+    for i, item in enumerate(items):
+        try:
+            values[i] = (_int(item, 'quantity', 0) if 'quantity' in item else 0,
+                         _int(item, 'location_id', 1, nullable=True))
+        except ValueError as e:
+            errors.append((i, str(e)))
+    errors += _unknown_refs(items, {'location_id': Location}, errors)
+    if errors:
+        return batch_errors(errors)
+
+    created = movements.save_products([
+        (None, {'name': names[i], 'description': item.get('description'),
+                'quantity': values[i][0], 'location_id': values[i][1]})
+        for i, item in enumerate(items)])
+    return jsonify(items=[product_json(p) for p in created]), 201
+
+
+@api.route('/products', methods=['PATCH'])
+def update_products():
+    try:
+        items = _items()
+        rows = _load(Product, items)
+    except ValueError as e:
+        return error(str(e))
+    names, errors = _check_names(Product, items, existing_ids=rows)
+    for i, item in enumerate(items):
+        try:
+            if item['id'] not in rows:
+                raise ValueError(f'product {item["id"]} not found')
+            if 'quantity' in item:
+                _int(item, 'quantity', 0)
+            if 'location_id' in item:
+                _int(item, 'location_id', 1, nullable=True)
+        except ValueError as e:
+            errors.append((i, str(e)))
+    errors += _unknown_refs(items, {'location_id': Location}, errors)
+    if errors:
+        return batch_errors(errors)
+
+    fields = ('description', 'quantity', 'location_id')
+    changes = []
+    for i, item in enumerate(items):
+        values = {key: item[key] for key in fields if key in item}
+        if i in names:
+            values['name'] = names[i]
+        changes.append((item['id'], values))
+    saved = {p.id: p for p in movements.save_products(changes)}
+    return jsonify(items=[product_json(saved[item['id']]) for item in items if item['id'] in saved])
+
+
+@api.route('/locations')
+@ledger_etag
+def list_locations():
+    after_id = request.args.get('after_id', 0, type=int)
+    rows = Location.query.filter(Location.id > after_id).order_by(Location.id).limit(_limit()).all()
+    return jsonify(items=[location_json(loc) for loc in rows],
+                   next_after_id=rows[-1].id if rows else None)
+
+
+@api.route('/locations/search')
+@ledger_etag
+def search_locations():
+    return _search(Location)
+
+
+@api.route('/locations/<int:id>')
+@ledger_etag
+def get_location(id):
+    loc = db.session.get(Location, id)
+    if loc is None:
+        return error('location not found', 404)
+    return jsonify(location_json(loc))
+
+
+@api.route('/locations', methods=['POST'])
+def create_locations():
+    try:
+        items = _items()
+    except ValueError as e:
+        return error(str(e))
+    names, errors = _check_names(Location, items)
+    if errors:
+        return batch_errors(errors)
+
+    created = [Location(name=names[i], address=item.get('address')) for i, item in enumerate(items)]
+    db.session.add_all(created)
+    db.session.commit()
+    return jsonify(items=[location_json(loc) for loc in created]), 201
+
+
+@api.route('/locations', methods=['PATCH'])
+def update_locations():
+    try:
+        items = _items()
+        rows = _load(Location, items)
+    except ValueError as e:
+        return error(str(e))
+    names, errors = _check_names(Location, items, existing_ids=rows)
+    errors += [(i, f'location {item["id"]} not found') for i, item in enumerate(items) if item['id'] not in rows]
+    if errors:
+        return batch_errors(errors)
+
+    for i, item in enumerate(items):
+        loc = rows[item['id']]
+        if i in names:
+            loc.name = names[i]
+        if 'address' in item:
+            loc.address = item['address']
+    db.session.commit()
+    return jsonify(items=[location_json(rows[item['id']]) for item in items])
+
+
+@api.route('/movements')
+@ledger_etag
+def list_movements():
+    # same filters and (timestamp, id) cursor as the /movements page
+    try:
+        q = movement_query(request.args)
+    except ValueError:
+        return error('invalid date or cursor')
+    limit = _limit()
+    page = q.limit(limit + 1).all()
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1][0].timestamp, page[-1][0].id)
+    items = [{
+        'id': m.id, 'timestamp': m.timestamp.isoformat(), 'qty': m.qty,
+        'product_id': m.product_id, 'product': product_name,
+        'from_location_id': m.from_location, 'from_location': from_name,
+        'to_location_id': m.to_location, 'to_location': to_name,
+    } for m, product_name, from_name, to_name in page]
+    return jsonify(items=items, next_cursor=next_cursor)
+
+
+@api.route('/movements', methods=['POST'])
+def create_movements():
+    # items look like import rows: product, from_location, to_location (name or id), qty, timestamp
+    try:
+        items = _items()
+    except ValueError as e:
+        return error(str(e))
+    batch = []
+    errors = []
+    for i, item in enumerate(items):
+        try:
+            batch.append(parse_record(item))
+        except ValueError as e:
+            errors.append((i, str(e)))
+    if errors:
+        return batch_errors(errors)
+
+    # names are created as needed; numeric ids have to exist already
+    refs = [dict(zip(('product_id', 'from_location', 'to_location'),
+                     (int(v) if v and v.isdigit() else None for v in row[:3]))) for row in batch]
+    errors = _unknown_refs(refs, {'product_id': Product, 'from_location': Location,
+                                  'to_location': Location}, [])
+    if errors:
+        return batch_errors(errors)
+
+    try:
+        created = movements.record_movements(batch)
+    except movements.InsufficientStock as e:
+        return error(str(e), 409, product_id=e.product_id, location_id=e.location_id)
+    return jsonify(created=len(created)), 201
+
+
+@api.route('/movements', methods=['PATCH'])
+def update_movements():
+    try:
+        items = _items()
+        rows = _load(ProductMovement, items)
+    except ValueError as e:
+        return error(str(e))
+    errors = []
+    for i, item in enumerate(items):
+        try:
+            m = rows.get(item['id'])
+            if m is None:
+                raise ValueError(f'movement {item["id"]} not found')
+            if 'product_id' in item:
+                _int(item, 'product_id', 1)
+            if 'qty' in item:
+                _int(item, 'qty', 1)
+            from_loc = _int(item, 'from_location', 1, nullable=True) if 'from_location' in item else m.from_location
+            to_loc = _int(item, 'to_location', 1, nullable=True) if 'to_location' in item else m.to_location
+            if not from_loc and not to_loc:
+                raise ValueError('from_location or to_location is required')
+        except ValueError as e:
+            errors.append((i, str(e)))
+    errors += _unknown_refs(items, {'product_id': Product, 'from_location': Location,
+                                    'to_location': Location}, errors)
+    if errors:
+        return batch_errors(errors)
+
+    fields = ('product_id', 'from_location', 'to_location', 'qty')
+    changes = [(item['id'], {key: item[key] for key in fields if key in item}) for item in items]
+    try:
+        updated = movements.update_movements(changes)
+    except movements.InsufficientStock as e:
+        return error(str(e), 409, product_id=e.product_id, location_id=e.location_id)
+    return jsonify(updated=len(updated))
+
+
+@api.route('/stock')
+@ledger_etag
+def stock():
+    q = db.session.query(StockBalance.product_id, StockBalance.location_id, StockBalance.qty) \
+        .filter(StockBalance.qty != 0)
+    product_id = request.args.get('product_id', type=int)
+    if product_id is not None:
+        q = q.filter(StockBalance.product_id == product_id)
+    location_id = request.args.get('location_id', type=int)
+    if location_id is not None:
+        q = q.filter(StockBalance.location_id == location_id)
+    rows = q.order_by(StockBalance.product_id, StockBalance.location_id).all()
+    return jsonify(version=ledger_version(),
+                   items=[{'product_id': pid, 'location_id': lid, 'qty': qty} for pid, lid, qty in rows])
+
+
+def job_json(job):
+    return {
+        'id': job.id, 'kind': job.kind, 'status': job.status, 'progress': job.progress,
+        'params': {k: v for k, v in json.loads(job.params).items() if k != 'path'},
+        'result': json.loads(job.result) if job.result else None,
+        'result_url': url_for('api.job_result', id=job.id) if job.result_file else None,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+@api.route('/jobs', methods=['POST'])
+def submit_job():
+    # JSON {"kind": ..., "params": {...}}, or a multipart form with kind, format and file for imports
+    if request.files:
+        kind = request.form.get('kind', 'import')
+        upload = request.files.get('file')
+        params = {'fmt': request.form.get('format') or detect_format(upload.filename if upload else '')}
+    else:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get('kind'), str):
+            return error('expected a JSON object with a kind')
+        kind = body['kind']
+        params = body.get('params') or {}
+        upload = None
+        # the same string values a form or query string would carry
+        if not isinstance(params, dict) or not all(isinstance(v, str) for v in params.values()):
+            return error('params must be a JSON object of strings')
+    try:
+        job = jobs.submit(kind, params, upload)
+    except ValueError as e:
+        return error(str(e))
+    resp = jsonify(job_json(job))
+    resp.status_code = 202
+    resp.headers['Location'] = url_for('api.get_job', id=job.id)
+    return resp
+
+
+@api.route('/jobs/<id>')
+def get_job(id):
+    job = db.session.get(Job, id)
+    if job is None:
+        return error('job not found', 404)
+    return jsonify(job_json(job))
+
+
+@api.route('/jobs/<id>/result')
+def job_result(id):
+    job = db.session.get(Job, id)
+    if job is None:
+        return error('job not found', 404)
+    if job.status != 'done' or not job.result_file:
+        return error(f'job is {job.status} and has no file to download', 409)
+    ext = job.result_file.rsplit('.', 1)[-1]
+    return send_file(jobs.result_path(job), as_attachment=True,
+                     download_name=f"{job.kind.replace('export-', '')}.{ext}")
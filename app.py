@@ -1,42 +1,71 @@
 
-from flask import Flask, render_template, request, redirect, url_for, flash, get_flashed_messages
-from models import db, Product, Location, ProductMovement
-from sqlalchemy import text
+from flask import Flask, Response, render_template, stream_template, stream_with_context, request, redirect, url_for, flash, get_flashed_messages, g, abort
+from models import db, Product, Location, ProductMovement, Job
+from stock import diff_balances, rebuild_balances
+from importer import detect_format, read_records, import_movements
+import exporter
+from checkpoints import build_checkpoints, compact_checkpoints
+from queries import as_of_rows, movement_query, names_by_id, report_query, encode_cursor, parse_as_of
+from lookups import lookup_options, resolve_id
+from movements import (InsufficientStock, record_movement, remove_location, remove_movement, remove_product,
+                       save_products, update_movements)
+from flask_migrate import Migrate, upgrade
+from dbconfig import database_uri, engine_options
+import instrumentation
+import jobs
+from api import api
+from datetime import timedelta
+import click
+import io
+import json
 import os
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET', 'inventory_secret_123')
 
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///inventory.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['MOVEMENTS_PAGE_SIZE'] = int(os.environ.get('MOVEMENTS_PAGE_SIZE', 50))
+app.config['MOVEMENTS_MAX_PAGE_SIZE'] = int(os.environ.get('MOVEMENTS_MAX_PAGE_SIZE', 500))
 db.init_app(app)
-
-with app.app_context():
-    db.create_all()
-
-    try:
-        with db.engine.connect() as conn:
-            res = conn.execute(text("PRAGMA table_info(product)"))
-            existing = [row[1] for row in res.fetchall()]
-            if 'quantity' not in existing:
-                conn.execute(text("ALTER TABLE product ADD COLUMN quantity INTEGER NOT NULL DEFAULT 0"))
-            if 'location_id' not in existing:
-                conn.execute(text("ALTER TABLE product ADD COLUMN location_id INTEGER"))
-    except Exception as e:
-        
-        print('Migration check error:', e)
-
+# schema changes live in migrations/; run `flask db upgrade` after pulling
+migrate = Migrate(app, db, render_as_batch=True)
+instrumentation.init_app(app)
+app.register_blueprint(api)
+
+def _resolve_names(model, ids, cache_key, unknown):
+    # batched lookups for the ids not yet seen in this request
+    cache = g.setdefault(cache_key, {})
+    missing = {i for i in ids if i is not None and i not in cache}
+    found = names_by_id(model, missing)
+    for row_id in missing:
+        cache[row_id] = found.get(row_id, unknown)
+    return {i: cache[i] for i in ids if i is not None}
+
+def get_product_names(pids):
+    return _resolve_names(Product, pids, 'product_names', 'Unknown Product')
+
+def get_location_names(lids):
+    return _resolve_names(Location, lids, 'location_names', 'Unknown Location')
 
 def get_product_name(pid):
-    p = Product.query.get(pid)
-    return p.name if p else "Unknown Product"
+    return get_product_names([pid]).get(pid, 'Unknown Product')
 
 def get_location_name(lid):
     if lid is None:
         return '---'
-    loc = Location.query.get(lid)
-    return loc.name if loc else 'Unknown Location'
+    return get_location_names([lid])[lid]
+
+def stock_message(e):
+    return f"Not enough stock at {get_location_name(e.location_id)}: only {e.available} available."
+
+def location_label(lid, name):
+    # display name for a location column that came back from an outer join
+    if lid is None:
+        return '---'
+    return name or 'Unknown Location'
 
 
 @app.route('/')
@@ -50,8 +79,6 @@ def products():
 
 @app.route('/product/add', methods=['GET', 'POST'])
 def add_product():
-    # fetch locations for the dropdown
-    locations = Location.query.order_by(Location.name).all()
     if request.method == 'POST':
         name = request.form.get('name', '').strip()
         description = request.form.get('description', '').strip()
@@ -66,46 +93,57 @@ def add_product():
         if not name:
             flash("Product name is required.")
             return redirect(url_for('add_product'))
+        if Product.query.filter_by(name=name).first():
+            flash("A product with that name already exists.")
+            return redirect(url_for('add_product'))
+        try:
+            location_id = resolve_id(Location, loc_in)
+        except ValueError:
+            flash("Unknown location.")
+            return redirect(url_for('add_product'))
 
-        
-        location_id = int(loc_in) if loc_in else None
-
-        new_p = Product(name=name, description=description, quantity=quantity, location_id=location_id)
-        db.session.add(new_p)
-        db.session.commit()
+        save_products([(None, {'name': name, 'description': description, 'quantity': quantity,
+                               'location_id': location_id})])
         flash("✅ Product added.")
         return redirect(url_for('products'))
 
-    return render_template('include_product.html', locations=locations)
+    # small catalogs come as cached <select> options, large ones as type-ahead
+    return render_template('include_product.html', locations=lookup_options(Location))
 
 @app.route('/product/edit/<int:id>', methods=['GET', 'POST'])
 def edit_product(id):
     product = Product.query.get_or_404(id)
-    # fetch locations for the dropdown
-    locations = Location.query.order_by(Location.name).all()
     if request.method == 'POST':
-        product.name = request.form.get('name', product.name).strip()
         qty_raw = request.form.get('quantity', product.quantity)
         loc_in = request.form.get('location') or ''
         try:
-            product.quantity = int(qty_raw)
+            quantity = int(qty_raw)
         except ValueError:
             flash('Quantity must be a number.')
             return redirect(url_for('edit_product', id=id))
 
-        product.location_id = int(loc_in) if loc_in else None
-        db.session.commit()
+        name = request.form.get('name', product.name).strip()
+        if Product.query.filter(Product.name == name, Product.id != id).first():
+            flash('A product with that name already exists.')
+            return redirect(url_for('edit_product', id=id))
+        try:
+            location_id = resolve_id(Location, loc_in)
+        except ValueError:
+            flash('Unknown location.')
+            return redirect(url_for('edit_product', id=id))
+
+        save_products([(id, {'name': name, 'quantity': quantity, 'location_id': location_id})])
         flash(" Product updated.")
         return redirect(url_for('products'))
 
 
-    return render_template('alter_product.html', product=product, locations=locations)
+    return render_template('alter_product.html', product=product, locations=lookup_options(Location),
+                           location_name=get_location_name(product.location_id) if product.location_id else '')
 
 @app.route('/product/delete/<int:id>', methods=['POST'])
 def delete_product(id):
-    product = Product.query.get_or_404(id)
-    db.session.delete(product)
-    db.session.commit()
+    if remove_product(id) is None:
+        abort(404)
     flash(" Product deleted.")
     return redirect(url_for('products'))
 
@@ -123,6 +161,9 @@ def add_location():
         if not name:
             flash("Location name is required.")
             return redirect(url_for('add_location'))
+        if Location.query.filter_by(name=name).first():
+            flash("A location with that name already exists.")
+            return redirect(url_for('add_location'))
         new_l = Location(name=name)
         db.session.add(new_l)
         db.session.commit()
@@ -135,7 +176,11 @@ def add_location():
 def edit_location(id):
     location = Location.query.get_or_404(id)
     if request.method == 'POST':
-        location.name = request.form.get('name', location.name).strip()
+        name = request.form.get('name', location.name).strip()
+        if Location.query.filter(Location.name == name, Location.id != id).first():
+            flash("A location with that name already exists.")
+            return redirect(url_for('edit_location', id=id))
+        location.name = name
         db.session.commit()
         flash("Location updated.")
         return redirect(url_for('location'))
@@ -144,28 +189,52 @@ def edit_location(id):
 
 @app.route('/location/delete/<int:id>', methods=['POST'])
 def delete_location(id):
-    location = Location.query.get_or_404(id)
-    db.session.delete(location)
-    db.session.commit()
+    if remove_location(id) is None:
+        abort(404)
     flash("Location deleted.")
     return redirect(url_for('location'))
 
 
-@app.route('/movements')
-def move_product():
-    
-    moves = ProductMovement.query.order_by(ProductMovement.timestamp.desc()).all()
-    movement_list = []
-    for m in moves:
-        movement_list.append({
+def movement_rows(rows):
+    for m, product_name, from_name, to_name in rows:
+        yield {
             'id': m.id,
-            'product_name': get_product_name(m.product_id),
-            'from_location': get_location_name(m.from_location),
-            'to_location': get_location_name(m.to_location),
+            'product_name': product_name or 'Unknown Product',
+            'from_location': location_label(m.from_location, from_name),
+            'to_location': location_label(m.to_location, to_name),
             'qty': m.qty,
             'timestamp': m.timestamp
-        })
-    return render_template('move_product.html', movements=movement_list)
+        }
+
+@app.route('/movements')
+def move_product():
+    filters = {k: request.args[k] for k in ('product', 'location', 'start', 'end') if request.args.get(k)}
+    try:
+        q = movement_query(request.args)
+    except ValueError:
+        flash("Invalid date or page cursor.")
+        return redirect(url_for('move_product'))
+
+    # stream=1 renders the whole filtered ledger in chunks instead of one page
+    if request.args.get('stream'):
+        rows = movement_rows(q.yield_per(1000))
+        return stream_template('move_product.html', movements=rows, filters=filters,
+                               next_url=None, streaming=True)
+
+    per_page = request.args.get('per_page', app.config['MOVEMENTS_PAGE_SIZE'], type=int)
+    per_page = max(1, min(per_page, app.config['MOVEMENTS_MAX_PAGE_SIZE']))
+    page = q.limit(per_page + 1).all()
+
+    next_url = None
+    if len(page) > per_page:
+        page = page[:per_page]
+        last = page[-1][0]
+        next_url = url_for('move_product', per_page=per_page,
+                           cursor=encode_cursor(last.timestamp, last.id), **filters)
+
+    movement_list = list(movement_rows(page))
+    return render_template('move_product.html', movements=movement_list, filters=filters,
+                           next_url=next_url, streaming=False)
 
 @app.route('/movement/add', methods=['GET', 'POST'])
 def add_movement():
@@ -193,51 +262,53 @@ def add_movement():
             return redirect(url_for('add_movement'))
 
 
-        def resolve_product(inp):
-            if inp.isdigit():
-                return int(inp)
-        
-            p = Product.query.filter_by(name=inp).first()
-            if p:
-                return p.id
-            newp = Product(name=inp)
-            db.session.add(newp)
-            db.session.commit()
-            return newp.id
-
-        
-        def resolve_location(inp):
-            if not inp:
-                return None
-            if inp.isdigit():
-                return int(inp)
-            loc = Location.query.filter_by(name=inp).first()
-            if loc:
-                return loc.id
-            newl = Location(name=inp)
-            db.session.add(newl)
-            db.session.commit()
-            return newl.id
-
-        product_id = resolve_product(product_input)
-        from_loc = resolve_location(from_input)
-        to_loc = resolve_location(to_input)
-
-        
-        move = ProductMovement(product_id=product_id, from_location=from_loc, to_location=to_loc, qty=qty)
-        db.session.add(move)
-        db.session.commit()
+        # names are created on first use; the source balance is checked under a lock
+        try:
+            record_movement(product_input, from_input, to_input, qty)
+        except InsufficientStock as e:
+            flash(stock_message(e))
+            return redirect(url_for('add_movement'))
+        except ValueError as e:
+            flash(f'Could not save: {e}.')
+            return redirect(url_for('add_movement'))
         flash("✅ Movement recorded.")
         return redirect(url_for('move_product'))
 
     
     return render_template('include_move.html')
 
+@app.route('/movement/import', methods=['GET', 'POST'])
+def import_movements_view():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash("Please choose a CSV or JSONL file.")
+            return redirect(url_for('import_movements_view'))
+
+        fmt = request.form.get('format') or detect_format(upload.filename)
+        if request.form.get('background'):
+            try:
+                job = jobs.submit('import', {'fmt': fmt}, upload)
+            except ValueError as e:
+                flash(f"Could not start the job: {e}.")
+                return redirect(url_for('import_movements_view'))
+            return redirect(url_for('job_status', id=job.id))
+        fh = io.TextIOWrapper(upload.stream, encoding='utf-8-sig')
+        result = import_movements(read_records(fh, fmt))
+        flash(f"✅ Imported {result['imported']} movement(s) in {result['seconds']:.2f}s "
+              f"({result['rows_per_sec']:.0f} rows/sec), {len(result['errors'])} error(s).")
+        return render_template('import_movements.html', result=result)
+
+    return render_template('import_movements.html', result=None)
+
 @app.route('/movement/delete/<int:id>', methods=['POST'])
 def delete_movement(id):
-    move = ProductMovement.query.get_or_404(id)
-    db.session.delete(move)
-    db.session.commit()
+    try:
+        if remove_movement(id) is None:
+            abort(404)
+    except InsufficientStock as e:
+        flash(stock_message(e))
+        return redirect(url_for('move_product'))
     flash(" Movement deleted.")
     return redirect(url_for('move_product'))
 
@@ -245,14 +316,8 @@ def delete_movement(id):
 @app.route('/movement/edit/<int:id>', methods=['GET', 'POST'])
 def edit_movement(id):
     movement = ProductMovement.query.get_or_404(id)
-    products = Product.query.order_by(Product.name).all()
-    locations = Location.query.order_by(Location.name).all()
 
     if request.method == 'POST':
-    
-        prod = request.form.get('product')
-        from_loc = request.form.get('from_location') or None
-        to_loc = request.form.get('to_location') or None
         qty_raw = request.form.get('qty', '0')
         try:
             qty = int(qty_raw)
@@ -260,63 +325,188 @@ def edit_movement(id):
             flash('Quantity must be a number.')
             return redirect(url_for('edit_movement', id=id))
 
+        try:
+            prod = resolve_id(Product, request.form.get('product'))
+            from_loc = resolve_id(Location, request.form.get('from_location'))
+            to_loc = resolve_id(Location, request.form.get('to_location'))
+        except ValueError as e:
+            flash(f'Could not save: {e}.')
+            return redirect(url_for('edit_movement', id=id))
         if not prod:
             flash('Please select a product.')
             return redirect(url_for('edit_movement', id=id))
 
-        movement.product_id = int(prod)
-        movement.from_location = int(from_loc) if from_loc else None
-        movement.to_location = int(to_loc) if to_loc else None
-        movement.qty = qty
-        db.session.commit()
+        try:
+            update_movements([(id, {'product_id': prod, 'from_location': from_loc,
+                                    'to_location': to_loc, 'qty': qty})])
+        except InsufficientStock as e:
+            flash(stock_message(e))
+            return redirect(url_for('edit_movement', id=id))
         flash(' Movement updated.')
         return redirect(url_for('move_product'))
 
-    return render_template('edit_movement.html', movement=movement, products=products, locations=locations)
+    return render_template('edit_movement.html', movement=movement,
+                           products=lookup_options(Product), locations=lookup_options(Location),
+                           product_name=get_product_name(movement.product_id),
+                           from_name=get_location_name(movement.from_location) if movement.from_location else '',
+                           to_name=get_location_name(movement.to_location) if movement.to_location else '')
 
 
 
 
 @app.route('/report')
 def report():
-    
-    balances = {}  
+    as_of_raw = request.args.get('as_of', '').strip()
+    if not as_of_raw:
+        report_rows = [
+            {'product_name': pname, 'location_name': lname, 'qty': qty}
+            for _, _, pname, lname, qty in report_query().all()
+        ]
+        return render_template('finalreport.html', report=report_rows, as_of=None)
 
-    
-    products = Product.query.order_by(Product.id).all()
-    for p in products:
-        if p.location_id:
-            key = (p.id, p.location_id)
-            balances[key] = balances.get(key, 0) + (p.quantity or 0)
+    try:
+        as_of = parse_as_of(as_of_raw)
+    except ValueError:
+        flash("Invalid as-of date.")
+        return redirect(url_for('finalreport'))
+
+    report_rows = [
+        {'product_name': pname, 'location_name': lname, 'qty': qty}
+        for _, _, pname, lname, qty in as_of_rows(as_of)
+    ]
+    return render_template('finalreport.html', report=report_rows, as_of=as_of_raw)
 
-    
-    moves = ProductMovement.query.order_by(ProductMovement.timestamp).all()
-    for m in moves:
-        if m.from_location:
-            key = (m.product_id, m.from_location)
-            balances[key] = balances.get(key, 0) - m.qty
-        if m.to_location:
-            key = (m.product_id, m.to_location)
-            balances[key] = balances.get(key, 0) + m.qty
 
-    report_rows = []
-    for (pid, lid), qty in balances.items():
-        if qty == 0:
-            continue
-        report_rows.append({
-            'product_name': get_product_name(pid),
-            'location_name': get_location_name(lid),
-            'qty': qty
-        })
 
+app.add_url_rule('/report', endpoint='finalreport', view_func=report)
 
-    report_rows.sort(key=lambda r: (r['product_name'], r['location_name']))
-    return render_template('finalreport.html', report=report_rows)
 
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
 
+def export_response(chunks, name, fmt):
+    return Response(stream_with_context(chunks), mimetype=EXPORT_MIMETYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={name}.{fmt}'})
 
-app.add_url_rule('/report', endpoint='finalreport', view_func=report)
+@app.route('/report.<fmt>')
+def export_report(fmt):
+    if fmt not in EXPORT_MIMETYPES:
+        abort(404)
+    records = exporter.report_records(report_query().yield_per(exporter.FETCH_SIZE))
+    return export_response(exporter.render(records, fmt, exporter.REPORT_FIELDS), 'report', fmt)
+
+@app.route('/movements.<fmt>')
+def export_movements(fmt):
+    # takes the same product/location/date filters as /movements, without paging
+    if fmt not in EXPORT_MIMETYPES:
+        abort(404)
+    try:
+        q = movement_query(request.args)
+    except ValueError:
+        abort(400)
+    records = exporter.movement_records(q)
+    return export_response(exporter.render(records, fmt, exporter.MOVEMENT_FIELDS), 'movements', fmt)
+
+@app.route('/jobs', methods=['POST'])
+def start_job():
+    # heavy exports and rebuilds from the UI, run off the request path
+    params = {k: v for k, v in request.form.items() if k != 'kind' and v}
+    try:
+        job = jobs.submit(request.form.get('kind', ''), params)
+    except ValueError as e:
+        flash(f"Could not start the job: {e}.")
+        return redirect(request.referrer or url_for('home'))
+    return redirect(url_for('job_status', id=job.id))
+
+@app.route('/jobs/<id>')
+def job_status(id):
+    job = db.get_or_404(Job, id)
+    result = json.loads(job.result) if job.result else None
+    return render_template('job.html', job=job, result=result)
+
+
+@app.cli.command('rebuild-balances')
+@click.option('--check', is_flag=True, help='Only compare the stock_balance table against a ledger replay.')
+def rebuild_balances_command(check):
+    """Replay the movement ledger into the stock_balance table."""
+    mismatches = diff_balances()
+    for pid, lid, expected, actual in mismatches:
+        click.echo(f'product {pid} @ location {lid}: ledger {expected}, table {actual}')
+    if check:
+        click.echo(f'{len(mismatches)} mismatched balance(s).')
+        if mismatches:
+            raise SystemExit(1)
+        return
+    count = rebuild_balances()
+    click.echo(f'Rebuilt {count} balance(s), fixed {len(mismatches)}.')
+
+
+@app.cli.command('build-checkpoints')
+@click.option('--every-days', default=1, show_default=True, help='Days between checkpoints.')
+def build_checkpoints_command(every_days):
+    """Snapshot balances periodically so /report?as_of= only replays recent movements."""
+    created = build_checkpoints(every=timedelta(days=every_days))
+    click.echo(f'Created {created} checkpoint(s).')
+
+
+@app.cli.command('compact-checkpoints')
+@click.option('--keep-days', default=30, show_default=True, help='Keep every checkpoint this recent.')
+def compact_checkpoints_command(keep_days):
+    """Thin older checkpoints down to one per month."""
+    removed = compact_checkpoints(keep_days=keep_days)
+    click.echo(f'Removed {removed} checkpoint(s).')
+
+
+def _write_export(chunks, output):
+    with click.open_file(output, 'w', encoding='utf-8') as fh:
+        for chunk in chunks:
+            fh.write(chunk)
+
+
+@app.cli.command('prune-jobs')
+@click.option('--keep-days', default=7, show_default=True, help='Keep finished jobs this recent.')
+@click.option('--stale-hours', default=24, show_default=True, help='Fail unfinished jobs older than this.')
+def prune_jobs_command(keep_days, stale_hours):
+    """Delete old background jobs and their files."""
+    deleted, failed = jobs.prune_jobs(keep_days=keep_days, stale_hours=stale_hours)
+    click.echo(f'Deleted {deleted} job(s), marked {failed} abandoned job(s) failed.')
+
+
+@app.cli.command('export-report')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default='csv', show_default=True)
+@click.option('--output', '-o', default='-', help='File to write, stdout by default.')
+def export_report_command(fmt, output):
+    """Write the stock report as CSV or JSONL."""
+    records = exporter.report_records(report_query().yield_per(exporter.FETCH_SIZE))
+    _write_export(exporter.render(records, fmt, exporter.REPORT_FIELDS), output)
+
+
+@app.cli.command('export-movements')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default='csv', show_default=True)
+@click.option('--output', '-o', default='-', help='File to write, stdout by default.')
+@click.option('--product', help='Product name or id.')
+@click.option('--location', help='Location name or id, either side of the move.')
+@click.option('--start', help='Earliest date, YYYY-MM-DD.')
+@click.option('--end', help='Latest date, YYYY-MM-DD.')
+def export_movements_command(fmt, output, **filters):
+    """Write the movement ledger as CSV or JSONL."""
+    records = exporter.movement_records(movement_query(filters))
+    _write_export(exporter.render(records, fmt, exporter.MOVEMENT_FIELDS), output)
+
+
+@app.cli.command('import-movements')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per transaction.')
+def import_movements_command(path, fmt, batch_size):
+    """Bulk-load movements from a CSV or JSONL file."""
+    with open(path, encoding='utf-8-sig', newline='') as fh:
+        result = import_movements(read_records(fh, fmt or detect_format(path)), batch_size=batch_size)
+    for line_no, error in result['errors']:
+        click.echo(f'line {line_no}: {error}', err=True)
+    click.echo(f"Imported {result['imported']} movement(s) in {result['seconds']:.2f}s "
+               f"({result['rows_per_sec']:.0f} rows/sec), {len(result['errors'])} error(s).")
 
 if __name__ == '__main__':
-   
+    with app.app_context():
+        upgrade()
     app.run(debug=True)
@@ -0,0 +1,117 @@
+"""Mixed read/write throughput across worker processes, for comparing database settings.
+
+    python -m benchmarks.concurrency_bench --workers 1,2,4,8 --journal-modes DELETE,WAL
+
+Each worker is a separate process with its own app and connection pool, like a
+gunicorn sync worker. Without DATABASE_URL every run gets a fresh SQLite file;
+with it, the runs use that database as-is unless --seed is given (use an empty one).
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+
+
+def _worker(args):
+    env, duration, write_ratio, products, locations, seed_value = args
+    os.environ.update(env)
+    from app import app
+
+    rng = random.Random(seed_value)
+    client = app.test_client()
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        if rng.random() < write_ratio:
+            resp = client.post('/movement/add', data={
+                'product': str(rng.randint(1, products)),
+                'from_location': str(rng.randint(1, locations)),
+                'to_location': str(rng.randint(1, locations)),
+                'qty': '1',
+            })
+            kind = 'writes'
+        else:
+            resp = client.get(rng.choice(['/report', '/movements']))
+            kind = 'reads'
+        latencies.append((time.perf_counter() - started) * 1000)
+        if resp.status_code >= 500:
+            counts['errors'] += 1
+        else:
+            counts[kind] += 1
+    return counts, latencies
+
+
+def _prepare(env, products, locations, movements):
+    os.environ.update(env)
+    from flask_migrate import upgrade
+    from app import app
+    from stock import rebuild_balances
+    from benchmarks.datagen import generate
+
+    with app.app_context():
+        upgrade()
+        generate(products, locations, movements)
+        rebuild_balances()
+
+
+def run(env, workers, duration, write_ratio, products, locations):
+    ctx = multiprocessing.get_context('spawn')
+    jobs = [(env, duration, write_ratio, products, locations, i) for i in range(workers)]
+    with ctx.Pool(workers) as pool:
+        results = pool.map(_worker, jobs)
+
+    totals = {'reads': 0, 'writes': 0, 'errors': 0}
+    latencies = []
+    for counts, lat in results:
+        for key in totals:
+            totals[key] += counts[key]
+        latencies.extend(lat)
+    latencies.sort()
+    return {
+        **totals,
+        'ops_per_sec': (totals['reads'] + totals['writes']) / duration,
+        'p50_ms': statistics.median(latencies) if latencies else 0.0,
+        'p95_ms': latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4,8', help='Comma-separated worker counts.')
+    parser.add_argument('--journal-modes', default='DELETE,WAL', help='SQLite journal modes to compare.')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per run.')
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--locations', type=int, default=20)
+    parser.add_argument('--movements', type=int, default=20000)
+    parser.add_argument('--seed', action='store_true', help='Seed the DATABASE_URL database first.')
+    args = parser.parse_args()
+
+    worker_counts = [int(w) for w in args.workers.split(',')]
+    modes = args.journal_modes.split(',') if not os.environ.get('DATABASE_URL') else ['server']
+
+    print(f'{"mode":<8} {"workers":>7} {"ops/s":>9} {"reads":>7} {"writes":>7} {"errors":>7} {"p50 ms":>8} {"p95 ms":>8}')
+    for mode in modes:
+        for workers in worker_counts:
+            with tempfile.TemporaryDirectory() as tmp:
+                env = {}
+                if mode != 'server':
+                    env = {'DATABASE_URL': f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                           'SQLITE_JOURNAL_MODE': mode}
+                if mode != 'server' or (args.seed and workers == worker_counts[0]):
+                    ctx = multiprocessing.get_context('spawn')
+                    proc = ctx.Process(target=_prepare, args=(env, args.products, args.locations, args.movements))
+                    proc.start()
+                    proc.join()
+                r = run(env, workers, args.duration, args.write_ratio, args.products, args.locations)
+                print(f'{mode:<8} {workers:>7} {r["ops_per_sec"]:>9.1f} {r["reads"]:>7} {r["writes"]:>7} '
+                      f'{r["errors"]:>7} {r["p50_ms"]:>8.1f} {r["p95_ms"]:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Synthetic inventory data with skewed product and location popularity.
+
+    python -m benchmarks.datagen --database-url sqlite:////tmp/bench.db \\
+        --products 10000 --locations 500 --movements 5000000
+
+Creates the schema with `flask db upgrade`, loads the data and rebuilds the
+materialized balances, so the database is ready for benchmarks.load.
+"""
+import argparse
+import itertools
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+
+from models import db, Product, Location, ProductMovement
+
+BATCH_SIZE = 50000
+START = datetime(2024, 1, 1)
+
+# share of inbound (no source), transfer and outbound (no destination) movements
+MOVE_KINDS = ('in', 'transfer', 'out')
+MOVE_KIND_WEIGHTS = (0.3, 0.55, 0.15)
+
+
+def zipf_weights(n, skew):
+    # rank-based popularity: a few hot items take most of the traffic
+    return list(itertools.accumulate(1.0 / (rank ** skew) for rank in range(1, n + 1)))
+
+
+def _reset_sequences():
+    # ids were inserted explicitly, so PostgreSQL's serial sequences still sit at 1
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for table in ('product', 'location'):
+        db.session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                f"(SELECT MAX(id) FROM {table}))"))
+    db.session.commit()
+
+
+def generate(products, locations, movements, skew=1.1, days=365, seed_value=42):
+    """Insert products, locations and movements; returns the (first, last) movement timestamps."""
+    rng = random.Random(seed_value)
+    product_ids = list(range(1, products + 1))
+    location_ids = list(range(1, locations + 1))
+    # shuffle so popularity isn't correlated with id
+    rng.shuffle(product_ids)
+    rng.shuffle(location_ids)
+    product_weights = zipf_weights(products, skew)
+    location_weights = zipf_weights(locations, skew)
+
+    db.session.execute(insert(Location.__table__),
+                       [{'id': i, 'name': f'Location {i}'} for i in range(1, locations + 1)])
+    opening_locations = rng.choices(location_ids, cum_weights=location_weights, k=products)
+    db.session.execute(insert(Product.__table__), [
+        {'id': i, 'name': f'Product {i}', 'quantity': rng.randint(0, 100), 'location_id': opening_locations[i - 1]}
+        for i in range(1, products + 1)
+    ])
+
+    step = timedelta(days=days) / max(movements, 1)
+    for offset in range(0, movements, BATCH_SIZE):
+        k = min(BATCH_SIZE, movements - offset)
+        pids = rng.choices(product_ids, cum_weights=product_weights, k=k)
+        sources = rng.choices(location_ids, cum_weights=location_weights, k=k)
+        targets = rng.choices(location_ids, cum_weights=location_weights, k=k)
+        kinds = rng.choices(MOVE_KINDS, weights=MOVE_KIND_WEIGHTS, k=k)
+        batch = []
+        for j in range(k):
+            kind = kinds[j]
+            batch.append({
+                'timestamp': START + step * (offset + j),
+                'product_id': pids[j],
+                'from_location': None if kind == 'in' else sources[j],
+                'to_location': None if kind == 'out' else targets[j],
+                'qty': rng.randint(1, 20),
+            })
+        db.session.execute(insert(ProductMovement.__table__), batch)
+        db.session.commit()
+
+    _reset_sequences()
+    return START, START + step * max(movements - 1, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True, help='Target database; should be empty.')
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--locations', type=int, default=500)
+    parser.add_argument('--movements', type=int, default=1000000)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent for popularity.')
+    parser.add_argument('--days', type=int, default=365, help='Time span of the ledger.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--checkpoints', action='store_true', help='Also build daily checkpoints.')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url
+    from flask_migrate import upgrade
+    from app import app
+    from stock import rebuild_balances
+    from checkpoints import build_checkpoints
+
+    with app.app_context():
+        upgrade()
+        started = time.perf_counter()
+        generate(args.products, args.locations, args.movements, args.skew, args.days, args.seed)
+        print(f'Generated {args.movements} movements in {time.perf_counter() - started:.1f}s')
+        started = time.perf_counter()
+        rebuild_balances()
+        print(f'Rebuilt balances in {time.perf_counter() - started:.1f}s')
+        if args.checkpoints:
+            started = time.perf_counter()
+            created = build_checkpoints()
+            print(f'Built {created} checkpoints in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Query plans and latencies for the hot ledger queries, before and after the index migration.
+
+    python -m benchmarks.index_bench --movements 1000000
+
+Seeds a throwaway SQLite database at the baseline revision, times each query,
+upgrades to head and times them again.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+
+from flask import Flask
+from flask_migrate import Migrate, upgrade
+from sqlalchemy import text
+
+from models import db
+from benchmarks.datagen import generate
+
+BASELINE = '5b1e0c2a9d41'
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+QUERIES = {
+    'ledger page': """
+        SELECT id FROM product_movement ORDER BY timestamp DESC, id DESC LIMIT 50""",
+    'ledger page by product': """
+        SELECT id FROM product_movement WHERE product_id = :pid
+        ORDER BY timestamp DESC, id DESC LIMIT 50""",
+    'ledger page by location': """
+        SELECT id FROM product_movement WHERE from_location = :lid OR to_location = :lid
+        ORDER BY timestamp DESC, id DESC LIMIT 50""",
+    'inbound to location': """
+        SELECT SUM(qty) FROM product_movement WHERE to_location = :lid AND product_id = :pid""",
+    'outbound from location': """
+        SELECT SUM(qty) FROM product_movement WHERE from_location = :lid AND product_id = :pid""",
+    'as-of replay window': """
+        SELECT product_id, from_location, to_location, qty FROM product_movement
+        WHERE timestamp >= :start AND timestamp <= :end""",
+    'product by name': """
+        SELECT id FROM product WHERE name = :pname""",
+    'location by name': """
+        SELECT id FROM location WHERE name = :lname""",
+}
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+    Migrate(app, db, directory=MIGRATIONS, render_as_batch=True)
+    return app
+
+
+def measure(params, repeat):
+    results = {}
+    for name, sql in QUERIES.items():
+        plan = [row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql), params)]
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            db.session.execute(text(sql), params).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = {'plan': plan, 'median_ms': statistics.median(timings)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--locations', type=int, default=500)
+    parser.add_argument('--movements', type=int, default=500000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            upgrade(directory=MIGRATIONS, revision=BASELINE)
+            started = time.perf_counter()
+            first, last = generate(args.products, args.locations, args.movements)
+            print(f'Seeded {args.movements} movements in {time.perf_counter() - started:.1f}s')
+
+            params = {
+                'pid': args.products // 2,
+                'lid': args.locations // 2,
+                'start': last - timedelta(days=1),
+                'end': last,
+                'pname': f'Product {args.products // 2}',
+                'lname': f'Location {args.locations // 2}',
+            }
+            before = measure(params, args.repeat)
+            db.session.remove()
+
+            started = time.perf_counter()
+            upgrade(directory=MIGRATIONS)
+            db.session.execute(text('ANALYZE'))
+            print(f'Index migration took {time.perf_counter() - started:.1f}s')
+            after = measure(params, args.repeat)
+            db.session.remove()
+
+        for name in QUERIES:
+            b, a = before[name], after[name]
+            speedup = b['median_ms'] / a['median_ms'] if a['median_ms'] else float('inf')
+            print(f'\n{name}: {b["median_ms"]:.2f} ms -> {a["median_ms"]:.2f} ms ({speedup:.1f}x)')
+            print('  before: ' + '; '.join(b['plan']))
+            print('  after:  ' + '; '.join(a['plan']))
+
+
+if __name__ == '__main__':
+    main()
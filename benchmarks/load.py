@@ -0,0 +1,307 @@
+"""Drive every app route with a weighted mix and record latency, SQL and memory per route.
+
+In-process, through the Flask test client (counts SQL statements per request):
+
+    python -m benchmarks.load --database-url sqlite:////tmp/bench.db --duration 60
+
+Over HTTP against a running server (e.g. gunicorn -w 4 app:app), from several processes:
+
+    python -m benchmarks.load --url http://127.0.0.1:8000 --workers 8 --duration 60 \\
+        --products 10000 --locations 500 --movements 1000000
+
+Results go to a JSON file; pass --compare with an earlier file to see the change per route.
+The mix edits and deletes rows, so point it at a database made by benchmarks.datagen.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import time
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+from benchmarks.datagen import START
+
+
+def _lower(state, kind):
+    # edits stay in the lower half of the seeded ids ...
+    return state['rng'].randint(1, max(1, state[kind] // 2))
+
+
+def _next_delete(state, kind):
+    # ... deletes walk down from the top, each worker on its own stride
+    key = f'{kind}_deleted'
+    state[key] = state.get(key, 0) + 1
+    return state[kind] - state['worker'] - (state[key] - 1) * state['workers']
+
+
+def _hot(state, kind):
+    # uniform over seeded ids; the generated ledger already carries the popularity skew
+    return state['rng'].randint(1, state[kind])
+
+
+def _unique(state, prefix):
+    state['added'] = state.get('added', 0) + 1
+    return f'{prefix} {os.getpid()}-{state["worker"]}-{state["added"]}'
+
+
+def _as_of(state):
+    return (START + timedelta(days=state['rng'].randint(0, state['days']))).date().isoformat()
+
+
+ROUTES = [
+    # name, weight, builder(state) -> (method, path, form data)
+    ('home', 2, lambda s: ('GET', '/', None)),
+    ('products', 5, lambda s: ('GET', '/products', None)),
+    ('locations', 5, lambda s: ('GET', '/locations', None)),
+    ('movements', 20, lambda s: ('GET', '/movements', None)),
+    ('movements_by_product', 10, lambda s: ('GET', f'/movements?product={_hot(s, "products")}', None)),
+    ('movements_by_location', 5, lambda s: ('GET', f'/movements?location={_hot(s, "locations")}', None)),
+    ('report', 15, lambda s: ('GET', '/report', None)),
+    ('report_as_of', 3, lambda s: ('GET', f'/report?as_of={_as_of(s)}', None)),
+    ('report_csv', 1, lambda s: ('GET', '/report.csv', None)),
+    ('movements_csv_by_product', 1, lambda s: ('GET', f'/movements.csv?product={_hot(s, "products")}', None)),
+    ('product_form', 2, lambda s: ('GET', '/product/add', None)),
+    ('movement_form', 2, lambda s: ('GET', '/movement/add', None)),
+    ('movement_edit_form', 2, lambda s: ('GET', f'/movement/edit/{_lower(s, "movements")}', None)),
+    ('product_add', 2, lambda s: ('POST', '/product/add', {
+        'name': _unique(s, 'Load product'), 'quantity': '5', 'location': str(_hot(s, 'locations'))})),
+    ('product_edit', 2, lambda s: ('POST', f'/product/edit/{_lower(s, "products")}', {
+        'quantity': str(s['rng'].randint(0, 100)), 'location': str(_hot(s, 'locations'))})),
+    ('product_delete', 1, lambda s: ('POST', f'/product/delete/{_next_delete(s, "products")}', {})),
+    ('location_add', 1, lambda s: ('POST', '/location/add', {'name': _unique(s, 'Load location')})),
+    ('location_edit', 1, lambda s: ('POST', f'/location/edit/{_lower(s, "locations")}', {})),
+    ('location_delete', 1, lambda s: ('POST', f'/location/delete/{_next_delete(s, "locations")}', {})),
+    ('movement_add', 10, lambda s: ('POST', '/movement/add', {
+        'product': str(_hot(s, 'products')), 'from_location': str(_hot(s, 'locations')),
+        'to_location': str(_hot(s, 'locations')), 'qty': '1'})),
+    ('movement_edit', 3, lambda s: ('POST', f'/movement/edit/{_lower(s, "movements")}', {
+        'product': str(_hot(s, 'products')), 'from_location': str(_hot(s, 'locations')),
+        'to_location': str(_hot(s, 'locations')), 'qty': str(s['rng'].randint(1, 20))})),
+    ('movement_delete', 2, lambda s: ('POST', f'/movement/delete/{_next_delete(s, "movements")}', {})),
+]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _pick(state):
+    names = [r[0] for r in ROUTES]
+    weights = [r[1] for r in ROUTES]
+    builders = {r[0]: r[2] for r in ROUTES}
+    while True:
+        name = state['rng'].choices(names, weights=weights)[0]
+        yield name, builders[name](state)
+
+
+def run_client(state, duration, trace_memory):
+    """In-process run through the test client; returns one record per request."""
+    from sqlalchemy import event
+    from app import app
+    from models import db
+
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count)
+    client = app.test_client()
+    if trace_memory:
+        tracemalloc.start()
+
+    records = []
+    deadline = time.perf_counter() + duration
+    for name, (method, path, data) in _pick(state):
+        if time.perf_counter() >= deadline:
+            break
+        statements[0] = 0
+        if trace_memory:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        resp = client.open(path, method=method, data=data)
+        resp.get_data()
+        elapsed = (time.perf_counter() - started) * 1000
+        records.append({
+            'route': name,
+            'ms': elapsed,
+            'status': resp.status_code,
+            'sql': statements[0],
+            'peak_bytes': tracemalloc.get_traced_memory()[1] if trace_memory else None,
+        })
+    return records
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def _http_worker(args):
+    base_url, state, duration = args
+    state['rng'] = random.Random(state['worker'])
+    opener = urllib.request.build_opener(_NoRedirect)
+    records = []
+    deadline = time.perf_counter() + duration
+    for name, (method, path, data) in _pick(state):
+        if time.perf_counter() >= deadline:
+            break
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        started = time.perf_counter()
+        try:
+            with opener.open(urllib.request.Request(base_url + path, data=body, method=method)) as resp:
+                resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except urllib.error.URLError:
+            status = 599
+        records.append({'route': name, 'ms': (time.perf_counter() - started) * 1000,
+                        'status': status, 'sql': None, 'peak_bytes': None})
+    return records
+
+
+def run_http(base_url, state, workers, duration):
+    ctx = multiprocessing.get_context('spawn')
+    jobs = []
+    for worker in range(workers):
+        worker_state = {k: v for k, v in state.items() if k != 'rng'}
+        worker_state['worker'] = worker
+        jobs.append((base_url.rstrip('/'), worker_state, duration))
+    with ctx.Pool(workers) as pool:
+        return [r for batch in pool.map(_http_worker, jobs) for r in batch]
+
+
+def summarize(records, duration):
+    routes = {}
+    for rec in records:
+        routes.setdefault(rec['route'], []).append(rec)
+
+    summary = {}
+    for name, recs in sorted(routes.items()):
+        ms = sorted(r['ms'] for r in recs)
+        sql = [r['sql'] for r in recs if r['sql'] is not None]
+        peaks = [r['peak_bytes'] for r in recs if r['peak_bytes'] is not None]
+        summary[name] = {
+            'requests': len(recs),
+            'errors': sum(1 for r in recs if r['status'] >= 500),
+            'p50_ms': percentile(ms, 0.50),
+            'p95_ms': percentile(ms, 0.95),
+            'p99_ms': percentile(ms, 0.99),
+            'mean_sql': sum(sql) / len(sql) if sql else None,
+            'max_sql': max(sql) if sql else None,
+            'peak_bytes': max(peaks) if peaks else None,
+        }
+    all_ms = sorted(r['ms'] for r in records)
+    totals = {
+        'requests': len(records),
+        'errors': sum(1 for r in records if r['status'] >= 500),
+        'throughput_rps': len(records) / duration if duration else 0.0,
+        'p50_ms': percentile(all_ms, 0.50),
+        'p95_ms': percentile(all_ms, 0.95),
+        'p99_ms': percentile(all_ms, 0.99),
+    }
+    return summary, totals
+
+
+def compare(previous, current):
+    print(f'\n{"route":<26} {"p95 before":>11} {"p95 now":>9} {"change":>8}')
+    for name, now in current['routes'].items():
+        before = previous.get('routes', {}).get(name)
+        if not before:
+            continue
+        change = (now['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+        print(f'{name:<26} {before["p95_ms"]:>11.2f} {now["p95_ms"]:>9.2f} {change:>+7.1f}%')
+    before_rps = previous.get('totals', {}).get('throughput_rps')
+    if before_rps:
+        print(f'throughput: {before_rps:.1f} -> {current["totals"]["throughput_rps"]:.1f} req/s')
+
+
+def _dataset_sizes():
+    from sqlalchemy import func
+    from app import app
+    from models import db, Product, Location, ProductMovement
+
+    with app.app_context():
+        return {
+            'products': db.session.query(func.max(Product.id)).scalar() or 1,
+            'locations': db.session.query(func.max(Location.id)).scalar() or 1,
+            'movements': db.session.query(func.max(ProductMovement.id)).scalar() or 1,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--database-url', help='Run in-process against this database.')
+    target.add_argument('--url', help='Run over HTTP against this server.')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds to run.')
+    parser.add_argument('--workers', type=int, default=4, help='HTTP client processes.')
+    parser.add_argument('--products', type=int, default=10000, help='Seeded products (HTTP mode).')
+    parser.add_argument('--locations', type=int, default=500, help='Seeded locations (HTTP mode).')
+    parser.add_argument('--movements', type=int, default=1000000, help='Seeded movements (HTTP mode).')
+    parser.add_argument('--days', type=int, default=365, help='Ledger time span, for as-of dates.')
+    parser.add_argument('--trace-memory', action='store_true', help='Per-route peak allocations (slower).')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='Earlier results file to compare against.')
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+        sizes = _dataset_sizes()
+        workers = 1
+    else:
+        sizes = {'products': args.products, 'locations': args.locations, 'movements': args.movements}
+        workers = args.workers
+    state = dict(sizes, days=args.days, worker=0, workers=workers, rng=random.Random(0))
+
+    started = time.perf_counter()
+    if args.database_url:
+        records = run_client(state, args.duration, args.trace_memory)
+    else:
+        records = run_http(args.url, state, workers, args.duration)
+    elapsed = time.perf_counter() - started
+
+    routes, totals = summarize(records, elapsed)
+    totals['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if args.database_url else None
+    results = {
+        'meta': {
+            'mode': 'client' if args.database_url else 'http',
+            'target': args.database_url or args.url,
+            'workers': workers,
+            'duration_s': elapsed,
+            'dataset': sizes,
+            'started_at': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+        },
+        'routes': routes,
+        'totals': totals,
+    }
+    with open(args.output, 'w') as fh:
+        json.dump(results, fh, indent=2)
+
+    print(f'{"route":<26} {"reqs":>6} {"err":>4} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"sql":>6}')
+    for name, r in routes.items():
+        sql = f'{r["mean_sql"]:.1f}' if r['mean_sql'] is not None else '-'
+        print(f'{name:<26} {r["requests"]:>6} {r["errors"]:>4} {r["p50_ms"]:>8.2f} '
+              f'{r["p95_ms"]:>8.2f} {r["p99_ms"]:>8.2f} {sql:>6}')
+    print(f'\n{totals["requests"]} requests, {totals["throughput_rps"]:.1f} req/s, '
+          f'{totals["errors"]} errors. Results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as fh:
+            compare(json.load(fh), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Parallel movement writers racing on the same stock and new names, then an integrity check.
+
+    python -m benchmarks.stress_movements --workers 8 --duration 20
+
+Every worker is its own process and app, like a gunicorn worker. They move a few
+hot products between a few locations, often asking for more than is left, and
+keep creating the same new product and location names. The run fails (exit
+status 1) if any balance went negative, a name exists twice, the materialized
+balances disagree with the ledger, or a request errored. Without DATABASE_URL it
+uses a fresh SQLite file; with it, give it an empty database.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+def random_movement(rng, products, locations):
+    """Form data for /movement/add: mostly transfers and issues that often ask for more than is left."""
+    kind = rng.random()
+    if kind < 0.1:
+        # the same handful of new names from every worker at once
+        return {'product': f'Racing product {rng.randint(1, 5)}',
+                'to_location': f'Racing location {rng.randint(1, 5)}', 'qty': '1'}
+    if kind < 0.3:
+        return {'product': str(rng.randint(1, products)),
+                'to_location': str(rng.randint(1, locations)), 'qty': str(rng.randint(1, 5))}
+    return {'product': str(rng.randint(1, products)),
+            'from_location': str(rng.randint(1, locations)),
+            'to_location': str(rng.randint(1, locations)) if rng.random() < 0.7 else '',
+            'qty': str(rng.randint(1, 8))}
+
+
+def _worker(args):
+    env, duration, products, locations, seed_value = args
+    os.environ.update(env)
+    from app import app
+
+    rng = random.Random(seed_value)
+    client = app.test_client()
+    counts = {'recorded': 0, 'refused': 0, 'errors': 0}
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        resp = client.post('/movement/add', data=random_movement(rng, products, locations))
+        if resp.status_code >= 500:
+            counts['errors'] += 1
+            continue
+        with client.session_transaction() as session:
+            messages = [m for _, m in session.pop('_flashes', [])]
+        if any('Not enough stock' in m for m in messages):
+            counts['refused'] += 1
+        else:
+            counts['recorded'] += 1
+    return counts
+
+
+def _prepare(env, products, locations):
+    os.environ.update(env)
+    from flask_migrate import upgrade
+    from sqlalchemy import insert
+    from app import app
+    from models import db, Product, Location
+
+    with app.app_context():
+        upgrade()
+        db.session.execute(insert(Location.__table__),
+                           [{'id': i, 'name': f'Location {i}'} for i in range(1, locations + 1)])
+        db.session.execute(insert(Product.__table__),
+                           [{'id': i, 'name': f'Product {i}', 'quantity': 0} for i in range(1, products + 1)])
+        db.session.commit()
+
+
+def problems():
+    """Integrity failures in the current app context's database, as readable strings."""
+    from sqlalchemy import func
+    from models import db, Product, Location, StockBalance
+    from stock import diff_balances
+
+    found = []
+    negative = StockBalance.query.filter(StockBalance.qty < 0).count()
+    if negative:
+        found.append(f'{negative} negative balance(s)')
+    for model in (Product, Location):
+        dupes = (db.session.query(model.name).group_by(model.name)
+                 .having(func.count(model.id) > 1).count())
+        if dupes:
+            found.append(f'{dupes} duplicated {model.__tablename__} name(s)')
+    mismatches = len(diff_balances())
+    if mismatches:
+        found.append(f'{mismatches} balance(s) disagree with the ledger')
+    return found
+
+
+def _check(env):
+    os.environ.update(env)
+    from app import app
+
+    with app.app_context():
+        return problems()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds to run.')
+    parser.add_argument('--products', type=int, default=3, help='Few products keep writers contending.')
+    parser.add_argument('--locations', type=int, default=3)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        # lock waits are expected here; keep them out of the slow query log
+        env = {'SLOW_QUERY_MS': os.environ.get('SLOW_QUERY_MS', '10000')}
+        if not os.environ.get('DATABASE_URL'):
+            env['DATABASE_URL'] = f'sqlite:///{os.path.join(tmp, "stress.db")}'
+        with ctx.Pool(1) as pool:
+            pool.apply(_prepare, (env, args.products, args.locations))
+
+        jobs = [(env, args.duration, args.products, args.locations, i) for i in range(args.workers)]
+        with ctx.Pool(args.workers) as pool:
+            results = pool.map(_worker, jobs)
+        totals = {key: sum(r[key] for r in results) for key in results[0]}
+        print(f'recorded {totals["recorded"]}, refused {totals["refused"]}, errors {totals["errors"]}')
+
+        with ctx.Pool(1) as pool:
+            problems = pool.apply(_check, (env,))
+        if totals['errors']:
+            problems.append(f'{totals["errors"]} request(s) failed')
+
+    for problem in problems:
+        print(f'FAIL: {problem}')
+    if problems:
+        sys.exit(1)
+    print('OK: no negative balances, no duplicate names, balances match the ledger')
+
+
+if __name__ == '__main__':
+    main()
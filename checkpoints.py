@@ -0,0 +1,196 @@
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, insert, tuple_, update
+from models import db, Product, ProductMovement, StockCheckpoint, StockCheckpointBalance
+
+FETCH_SIZE = 10000
+
+
+def _fold(balances, pid, from_loc, to_loc, qty):
+    if from_loc:
+        key = (pid, from_loc)
+        balances[key] = balances.get(key, 0) - qty
+    if to_loc:
+        key = (pid, to_loc)
+        balances[key] = balances.get(key, 0) + qty
+
+
+def _movement_columns():
+    return db.session.query(
+        ProductMovement.timestamp,
+        ProductMovement.product_id,
+        ProductMovement.from_location,
+        ProductMovement.to_location,
+        ProductMovement.qty,
+    )
+
+
+def _checkpoint_balances(cp):
+    rows = db.session.query(StockCheckpointBalance.product_id, StockCheckpointBalance.location_id,
+                            StockCheckpointBalance.qty).filter_by(checkpoint_id=cp.id)
+    return {(pid, lid): qty for pid, lid, qty in rows}
+
+
+def nearest_checkpoint(as_of):
+    return (StockCheckpoint.query.filter(StockCheckpoint.taken_at <= as_of)
+            .order_by(StockCheckpoint.taken_at.desc()).first())
+
+
+def balances_as_of(as_of):
+    """Stock per (product, location) including every movement up to and including as_of.
+
+    Starts from the nearest earlier checkpoint and replays only the movements after it.
+    Product opening quantities carry no date, so they always count.
+    """
+    cp = nearest_checkpoint(as_of)
+    balances = _checkpoint_balances(cp) if cp else {}
+
+    moves = _movement_columns().filter(ProductMovement.timestamp <= as_of)
+    if cp:
+        moves = moves.filter(ProductMovement.timestamp >= cp.taken_at)
+    for _, pid, from_loc, to_loc, qty in moves.yield_per(FETCH_SIZE):
+        _fold(balances, pid, from_loc, to_loc, qty)
+
+    products = db.session.query(Product.id, Product.location_id, Product.quantity).yield_per(FETCH_SIZE)
+    for pid, lid, qty in products:
+        if lid:
+            key = (pid, lid)
+            balances[key] = balances.get(key, 0) + (qty or 0)
+
+    return balances
+
+
+def _save_checkpoint(taken_at, balances):
+    cp = StockCheckpoint(taken_at=taken_at)
+    db.session.add(cp)
+    db.session.flush()
+    db.session.bulk_insert_mappings(StockCheckpointBalance, [
+        {'checkpoint_id': cp.id, 'product_id': pid, 'location_id': lid, 'qty': qty}
+        for (pid, lid), qty in balances.items() if qty != 0
+    ])
+    db.session.commit()
+
+
+def build_checkpoints(every=timedelta(days=1), until=None):
+    """Add a checkpoint at each `every` boundary since the latest one, up to `until`.
+
+    Boundaries with no movements since the previous checkpoint are skipped.
+    Returns the number of checkpoints created.
+    """
+    until = until or datetime.utcnow()
+    last = StockCheckpoint.query.order_by(StockCheckpoint.taken_at.desc()).first()
+    if last:
+        balances = _checkpoint_balances(last)
+        boundary = last.taken_at + every
+    else:
+        balances = {}
+        first = db.session.query(db.func.min(ProductMovement.timestamp)).scalar()
+        if first is None:
+            return 0
+        boundary = datetime(first.year, first.month, first.day) + every
+
+    moves = _movement_columns().filter(ProductMovement.timestamp < until)
+    if last:
+        moves = moves.filter(ProductMovement.timestamp >= last.taken_at)
+    moves = moves.order_by(ProductMovement.timestamp)
+
+    created = 0
+    dirty = False
+    for ts, pid, from_loc, to_loc, qty in moves.yield_per(FETCH_SIZE):
+        if ts >= boundary:
+            if dirty:
+                _save_checkpoint(boundary, balances)
+                created += 1
+                dirty = False
+            # jump straight to the boundary after this movement, skipping idle periods
+            boundary += every * ((ts - boundary) // every + 1)
+        _fold(balances, pid, from_loc, to_loc, qty)
+        dirty = True
+
+    if dirty and boundary <= until:
+        _save_checkpoint(boundary, balances)
+        created += 1
+    return created
+
+
+def compact_checkpoints(keep_days=30, now=None):
+    """Keep every checkpoint from the last keep_days, and only the first of each month before that."""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=keep_days)
+    seen_months = set()
+    stale = []
+    old = StockCheckpoint.query.filter(StockCheckpoint.taken_at < cutoff).order_by(StockCheckpoint.taken_at)
+    for cp in old:
+        month = (cp.taken_at.year, cp.taken_at.month)
+        if month in seen_months:
+            stale.append(cp.id)
+        else:
+            seen_months.add(month)
+    _delete_checkpoints(stale)
+    db.session.commit()
+    return len(stale)
+
+
+def _delete_checkpoints(ids):
+    if not ids:
+        return
+    StockCheckpointBalance.query.filter(StockCheckpointBalance.checkpoint_id.in_(ids)).delete(
+        synchronize_session=False)
+    StockCheckpoint.query.filter(StockCheckpoint.id.in_(ids)).delete(synchronize_session=False)
+
+
+_cp_balance = StockCheckpointBalance.__table__
+_ADD_QTY = (update(_cp_balance)
+            .where(_cp_balance.c.checkpoint_id == bindparam('cp'), _cp_balance.c.product_id == bindparam('pid'),
+                   _cp_balance.c.location_id == bindparam('lid'))
+            .values(qty=_cp_balance.c.qty + bindparam('delta')))
+
+
+def shift_checkpoints(moves, chunk_size=500):
+    """Fold movements written after the fact into the checkpoints taken after them.
+
+    moves: [(timestamp, product_id, from_location, to_location, qty)], with a negative
+    qty to take a movement back out. Checkpoints before the earliest timestamp are untouched.
+    """
+    if not moves:
+        return
+    later = (db.session.query(StockCheckpoint.id, StockCheckpoint.taken_at)
+             .filter(StockCheckpoint.taken_at > min(m[0] for m in moves))
+             .order_by(StockCheckpoint.taken_at).all())
+    if not later:
+        return
+
+    # each checkpoint gets the running total of the movements before it
+    moves = sorted(moves, key=lambda m: m[0])
+    running = {}
+    deltas = {}
+    done = 0
+    for cp_id, taken_at in later:
+        while done < len(moves) and moves[done][0] < taken_at:
+            _fold(running, *moves[done][1:])
+            done += 1
+        deltas.update(((cp_id, pid, lid), delta) for (pid, lid), delta in running.items() if delta)
+
+    cp_ids = [cp_id for cp_id, _ in later]
+    keys = list({(pid, lid) for _, pid, lid in deltas})
+    existing = set()
+    for start in range(0, len(keys), chunk_size):
+        existing.update(db.session.query(StockCheckpointBalance.checkpoint_id, StockCheckpointBalance.product_id,
+                                         StockCheckpointBalance.location_id)
+                        .filter(StockCheckpointBalance.checkpoint_id.in_(cp_ids),
+                                tuple_(StockCheckpointBalance.product_id, StockCheckpointBalance.location_id)
+                                .in_(keys[start:start + chunk_size])))
+    updates = [{'cp': cp, 'pid': pid, 'lid': lid, 'delta': delta}
+               for (cp, pid, lid), delta in deltas.items() if (cp, pid, lid) in existing]
+    if updates:
+        db.session.connection().execute(_ADD_QTY, updates)
+    new = [{'checkpoint_id': cp, 'product_id': pid, 'location_id': lid, 'qty': delta}
+           for (cp, pid, lid), delta in deltas.items() if (cp, pid, lid) not in existing]
+    if new:
+        db.session.connection().execute(insert(_cp_balance), new)
+    # checkpoints only keep non-zero balances
+    for start in range(0, len(keys), chunk_size):
+        (StockCheckpointBalance.query
+         .filter(StockCheckpointBalance.checkpoint_id.in_(cp_ids),
+                 tuple_(StockCheckpointBalance.product_id, StockCheckpointBalance.location_id)
+                 .in_(keys[start:start + chunk_size]),
+                 StockCheckpointBalance.qty == 0)
+         .delete(synchronize_session=False))
@@ -0,0 +1,67 @@
+import os
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_DATABASE_URI = 'sqlite:///inventory.db'
+
+
+def database_uri():
+    # DATABASE_URL as handed out by Render/Heroku, with the driver names SQLAlchemy expects
+    uri = os.environ.get('DATABASE_URL') or DEFAULT_DATABASE_URI
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    if uri.startswith('mysql://'):
+        uri = 'mysql+pymysql://' + uri[len('mysql://'):]
+    return uri
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def engine_options(uri):
+    if uri.startswith('sqlite'):
+        # pysqlite's own lock wait, on top of the busy_timeout pragma below
+        return {'connect_args': {'timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000}}
+
+    # networked databases: a small pool per gunicorn worker, checked before use and
+    # recycled before the server (MySQL wait_timeout, proxies) drops idle connections
+    return {
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': True,
+    }
+
+
+def sqlite_pragmas():
+    return {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000),
+        'mmap_size': _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        # negative means KiB rather than pages
+        'cache_size': _env_int('SQLITE_CACHE_SIZE', -64000),
+    }
+
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers carry on while one gunicorn worker writes
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in sqlite_pragmas().items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+    # SQLAlchemy emits BEGIN itself (see _begin_sqlite) instead of pysqlite's implicit one
+    dbapi_connection.isolation_level = None
+
+
+@event.listens_for(Engine, 'begin')
+def _begin_sqlite(conn):
+    # writers pass sqlite_begin='IMMEDIATE' to take the write lock before reading stock
+    if conn.dialect.name == 'sqlite':
+        conn.exec_driver_sql('BEGIN ' + conn.get_execution_options().get('sqlite_begin', 'DEFERRED'))
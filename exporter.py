@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+
+CHUNK_ROWS = 500
+FETCH_SIZE = 1000
+
+REPORT_FIELDS = ['product_id', 'product', 'location_id', 'location', 'qty']
+MOVEMENT_FIELDS = ['id', 'timestamp', 'product_id', 'product', 'from_location_id', 'from_location',
+                   'to_location_id', 'to_location', 'qty']
+
+
+def report_records(rows):
+    # rows shaped like queries.report_query() or queries.as_of_rows(); pass queries through yield_per
+    for pid, lid, product_name, location_name, qty in rows:
+        yield {'product_id': pid, 'product': product_name, 'location_id': lid,
+               'location': location_name, 'qty': qty}
+
+
+def movement_records(query):
+    for m, product_name, from_name, to_name in query.yield_per(FETCH_SIZE):
+        yield {
+            'id': m.id,
+            'timestamp': m.timestamp.isoformat(),
+            'product_id': m.product_id,
+            'product': product_name,
+            'from_location_id': m.from_location,
+            'from_location': from_name,
+            'to_location_id': m.to_location,
+            'to_location': to_name,
+            'qty': m.qty,
+        }
+
+
+def to_csv(records, fields):
+    # header first so the response starts before the first row is fetched
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fields)
+    writer.writeheader()
+    yield buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    for i, rec in enumerate(records, 1):
+        writer.writerow(rec)
+        if i % CHUNK_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def to_jsonl(records):
+    lines = []
+    for rec in records:
+        lines.append(json.dumps(rec))
+        if len(lines) >= CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def render(records, fmt, fields):
+    if fmt == 'jsonl':
+        return to_jsonl(records)
+    return to_csv(records, fields)
@@ -0,0 +1,215 @@
+import csv
+import json
+import time
+from datetime import datetime
+from sqlalchemy import func, insert
+from models import db, Product, Location, ProductMovement
+from stock import mark_ledger_changed
+from checkpoints import shift_checkpoints
+from lookups import mark_lookups_changed
+from movements import apply_checked, write_transaction
+
+BATCH_SIZE = 5000
+NAME_CHUNK_SIZE = 500
+
+
+def detect_format(filename):
+    name = (filename or '').lower()
+    if name.endswith('.jsonl') or name.endswith('.ndjson'):
+        return 'jsonl'
+    return 'csv'
+
+
+def read_records(fh, fmt):
+    # yields (line_no, record, error) from a CSV file with a header row or a JSON-lines file
+    if fmt == 'jsonl':
+        for line_no, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                yield line_no, None, 'invalid JSON'
+                continue
+            if not isinstance(rec, dict):
+                yield line_no, None, 'expected a JSON object'
+                continue
+            yield line_no, rec, None
+    else:
+        reader = csv.DictReader(fh)
+        for rec in reader:
+            yield reader.line_num, rec, None
+
+
+def _field(rec, key):
+    value = rec.get(key)
+    return '' if value is None else str(value).strip()
+
+
+def parse_record(rec):
+    # same rules as the /movement/add form; raises ValueError with a readable message
+    product = _field(rec, 'product')
+    from_loc = _field(rec, 'from_location')
+    to_loc = _field(rec, 'to_location')
+    if not product:
+        raise ValueError('product is required')
+    if not from_loc and not to_loc:
+        raise ValueError('from_location or to_location is required')
+    try:
+        qty = int(_field(rec, 'qty'))
+    except ValueError:
+        raise ValueError('qty must be a number')
+    if qty <= 0:
+        raise ValueError('qty must be at least 1')
+    ts_raw = _field(rec, 'timestamp')
+    try:
+        timestamp = datetime.fromisoformat(ts_raw) if ts_raw else None
+    except ValueError:
+        raise ValueError('timestamp must be ISO 8601')
+    return product, from_loc or None, to_loc or None, qty, timestamp
+
+
+def _resolve_names(model, names, cache):
+    # names -> ids for a whole batch: one lookup per chunk, then one bulk insert for the new ones
+    missing = list({n for n in names if n not in cache})
+    for start in range(0, len(missing), NAME_CHUNK_SIZE):
+        chunk = missing[start:start + NAME_CHUNK_SIZE]
+        lookup = (db.session.query(model.name, func.min(model.id))
+                  .filter(model.name.in_(chunk)).group_by(model.name))
+        cache.update(lookup)
+        new = [n for n in chunk if n not in cache]
+        if new:
+            db.session.execute(insert(model), [{'name': n} for n in new])
+            mark_lookups_changed(model)
+            cache.update(db.session.query(model.name, func.min(model.id))
+                         .filter(model.name.in_(new)).group_by(model.name))
+
+
+def _check_ids(model, ids, cache):
+    # numeric inputs -> ids that exist, one IN (...) per chunk; unknown ones stay out of the cache
+    missing = list({i for i in ids if i not in cache})
+    for start in range(0, len(missing), NAME_CHUNK_SIZE):
+        chunk = missing[start:start + NAME_CHUNK_SIZE]
+        found = {row_id for row_id, in db.session.query(model.id).filter(model.id.in_({int(i) for i in chunk}))}
+        cache.update((i, int(i)) for i in chunk if int(i) in found)
+
+
+def _unknown_id(batch_row, product_ids, location_ids):
+    product, from_loc, to_loc = batch_row[:3]
+    if product.isdigit() and product not in product_ids:
+        return f'unknown product id {product}'
+    for loc in (from_loc, to_loc):
+        if loc is not None and loc.isdigit() and loc not in location_ids:
+            return f'unknown location id {loc}'
+    return None
+
+
+def _ref(inp, cache):
+    return None if inp is None else cache[inp]
+
+
+def write_batch(batch, product_ids, location_ids):
+    """Insert parse_record() tuples in one locked transaction, creating missing names in bulk.
+
+    Rows that point at a product or location id that doesn't exist, or that would take
+    a balance below zero, are skipped; returns them as [(index in batch, error)].
+    """
+    skipped, products, locations = _write_batch(batch, product_ids, location_ids)
+    product_ids.update(products)
+    location_ids.update(locations)
+    return skipped
+
+
+@write_transaction
+def _write_batch(batch, known_products, known_locations):
+    # a retry must not reuse ids from the attempt that was rolled back, so work on copies
+    product_ids = dict(known_products)
+    location_ids = dict(known_locations)
+    _check_ids(Product, [p for p, _, _, _, _ in batch if p.isdigit()], product_ids)
+    _check_ids(Location, [l for _, f, t, _, _ in batch for l in (f, t)
+                          if l is not None and l.isdigit()], location_ids)
+    skipped = []
+    rows = []
+    for i, batch_row in enumerate(batch):
+        error = _unknown_id(batch_row, product_ids, location_ids)
+        if error:
+            skipped.append((i, error))
+        else:
+            rows.append((i, batch_row))
+    if not rows:
+        return skipped, product_ids, location_ids
+
+    # a name another writer inserts at the same time fails the batch, which write_transaction retries
+    _resolve_names(Product, [p for _, (p, _, _, _, _) in rows if not p.isdigit()], product_ids)
+    _resolve_names(Location, [l for _, (_, f, t, _, _) in rows for l in (f, t)
+                              if l is not None and not l.isdigit()], location_ids)
+
+    now = datetime.utcnow()
+    mappings = []
+    for _, (product, from_loc, to_loc, qty, timestamp) in rows:
+        mappings.append({'product_id': _ref(product, product_ids), 'from_location': _ref(from_loc, location_ids),
+                         'to_location': _ref(to_loc, location_ids), 'qty': qty, 'timestamp': timestamp or now})
+    refused = apply_checked([(m['product_id'], m['from_location'], m['to_location'], m['qty'], 1)
+                             for m in mappings], skip_refused=True)
+    skipped += [(rows[i][0], error) for i, error in refused]
+    refused = {i for i, _ in refused}
+    mappings = [m for i, m in enumerate(mappings) if i not in refused]
+
+    if mappings:
+        db.session.execute(insert(ProductMovement), mappings)
+        shift_checkpoints([(m['timestamp'], m['product_id'], m['from_location'], m['to_location'], m['qty'])
+                           for m in mappings])
+        mark_ledger_changed()
+    return sorted(skipped), product_ids, location_ids
+
+
+def import_movements(records, batch_size=BATCH_SIZE, progress=None):
+    """Bulk-load movements from read_records() output, one transaction per batch.
+
+    progress, if given, is called with the running row count after each batch.
+    """
+    started = time.perf_counter()
+    product_ids = {}
+    location_ids = {}
+    errors = []
+    imported = 0
+    batch = []
+    lines = []
+
+    def flush():
+        skipped = write_batch(batch, product_ids, location_ids)
+        errors.extend((lines[i], error) for i, error in skipped)
+        return len(batch) - len(skipped)
+
+    for line_no, rec, error in records:
+        if error is None:
+            try:
+                batch.append(parse_record(rec))
+                lines.append(line_no)
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            errors.append((line_no, error))
+            continue
+        if len(batch) >= batch_size:
+            imported += flush()
+            batch = []
+            lines = []
+            if progress:
+                progress(imported)
+
+    if batch:
+        imported += flush()
+    if progress:
+        progress(imported)
+    # unknown ids and stock refusals are only found when their batch is written
+    errors.sort(key=lambda e: e[0])
+
+    seconds = time.perf_counter() - started
+    return {
+        'imported': imported,
+        'errors': errors,
+        'seconds': seconds,
+        'rows_per_sec': imported / seconds if seconds else 0.0,
+    }
@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from models import db
+
+slow_log = logging.getLogger('inventory.slow')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SKIP_ENDPOINTS = ('static', 'metrics')
+
+_config = {'sample_rate': 1.0, 'slow_query_ms': 200.0, 'slow_request_ms': 1000.0, 'count_rows': True}
+_lock = threading.Lock()
+# (route, method, status) -> request count; route -> aggregates
+_requests = {}
+_routes = {}
+
+
+def _route_stats(route):
+    stats = _routes.get(route)
+    if stats is None:
+        stats = _routes[route] = {
+            'buckets': [0] * len(LATENCY_BUCKETS),
+            'count': 0,
+            'seconds': 0.0,
+            'sampled': 0,
+            'statements': 0,
+            'db_seconds': 0.0,
+            'rows': 0,
+        }
+    return stats
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _before_request():
+    if request.endpoint in SKIP_ENDPOINTS:
+        return
+    g.metrics_started = time.perf_counter()
+    # only sampled requests pay for per-statement accounting
+    if random.random() < _config['sample_rate']:
+        g.metrics_db = {'statements': 0, 'seconds': 0.0, 'rows': 0}
+
+
+def _after_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    args = (_route(), request.method, response.status_code, started, g.get('metrics_db'))
+    # streamed bodies (exports, ?stream=1) run their SQL after this hook, while the
+    # response is sent, so they are recorded once the server closes the response
+    if response.is_streamed:
+        response.call_on_close(lambda: _record(*args))
+    else:
+        _record(*args)
+    return response
+
+
+def _record(route, method, status, started, db_stats):
+    elapsed = time.perf_counter() - started
+    with _lock:
+        key = (route, method, status)
+        _requests[key] = _requests.get(key, 0) + 1
+        stats = _route_stats(route)
+        stats['count'] += 1
+        stats['seconds'] += elapsed
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                stats['buckets'][i] += 1
+        if db_stats is not None:
+            stats['sampled'] += 1
+            stats['statements'] += db_stats['statements']
+            stats['db_seconds'] += db_stats['seconds']
+            stats['rows'] += db_stats['rows']
+
+    if elapsed * 1000 >= _config['slow_request_ms']:
+        entry = {'event': 'slow_request', 'route': route, 'method': method,
+                 'status': status, 'ms': round(elapsed * 1000, 2)}
+        if db_stats is not None:
+            entry.update(statements=db_stats['statements'], db_ms=round(db_stats['seconds'] * 1000, 2))
+            if _config['count_rows']:
+                entry['rows'] = db_stats['rows']
+        slow_log.warning(json.dumps(entry))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the statement's own context, so a statement that raises leaves nothing behind
+    if context is not None and has_request_context() and 'metrics_db' in g:
+        context.metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_started', None)
+    if started is None or not has_request_context() or 'metrics_db' not in g:
+        return
+    elapsed = time.perf_counter() - started
+    db_stats = g.metrics_db
+    db_stats['statements'] += 1
+    db_stats['seconds'] += elapsed
+    # rows returned or affected, as the driver reports them; see init_app for SQLite
+    if _config['count_rows'] and cursor.rowcount and cursor.rowcount > 0:
+        db_stats['rows'] += cursor.rowcount
+
+    if elapsed * 1000 >= _config['slow_query_ms']:
+        slow_log.warning(json.dumps({
+            'event': 'slow_query', 'route': _route(), 'ms': round(elapsed * 1000, 2),
+            'statement': ' '.join(statement.split())[:500],
+        }))
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render_metrics():
+    """Prometheus text exposition of this worker process's counters."""
+    lines = [
+        '# HELP inventory_requests_total Requests served, by route, method and status.',
+        '# TYPE inventory_requests_total counter',
+    ]
+    with _lock:
+        requests = dict(_requests)
+        routes = {route: dict(stats, buckets=list(stats['buckets'])) for route, stats in _routes.items()}
+
+    for (route, method, status), count in sorted(requests.items()):
+        lines.append(f'inventory_requests_total{{route="{_label(route)}",method="{method}",status="{status}"}} {count}')
+
+    lines += [
+        '# HELP inventory_request_duration_seconds Request latency.',
+        '# TYPE inventory_request_duration_seconds histogram',
+    ]
+    for route, stats in sorted(routes.items()):
+        label = f'route="{_label(route)}"'
+        for bound, count in zip(LATENCY_BUCKETS, stats['buckets']):
+            lines.append(f'inventory_request_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'inventory_request_duration_seconds_bucket{{{label},le="+Inf"}} {stats["count"]}')
+        lines.append(f'inventory_request_duration_seconds_sum{{{label}}} {stats["seconds"]}')
+        lines.append(f'inventory_request_duration_seconds_count{{{label}}} {stats["count"]}')
+
+    counters = [
+        ('inventory_sampled_requests_total', 'sampled', 'Requests with database accounting (see sample rate).'),
+        ('inventory_db_statements_total', 'statements', 'SQL statements run by sampled requests.'),
+        ('inventory_db_duration_seconds_total', 'db_seconds', 'Time spent in SQL by sampled requests.'),
+    ]
+    if _config['count_rows']:
+        counters.append(('inventory_db_rows_total', 'rows', 'Rows returned or affected, as reported by the driver.'))
+    for name, key, help_text in counters:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for route, stats in sorted(routes.items()):
+            lines.append(f'{name}{{route="{_label(route)}"}} {stats[key]}')
+
+    lines += [
+        '# HELP inventory_metrics_sample_rate Fraction of requests with database accounting.',
+        '# TYPE inventory_metrics_sample_rate gauge',
+        f'inventory_metrics_sample_rate {_config["sample_rate"]}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """Hook request timing and SQL accounting into the app and expose /metrics."""
+    if os.environ.get('METRICS_ENABLED', '1') == '0':
+        return
+    _config['sample_rate'] = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+    _config['slow_query_ms'] = float(os.environ.get('SLOW_QUERY_MS', 200))
+    _config['slow_request_ms'] = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    with app.app_context():
+        # pysqlite reports no row count for SELECTs, so a rows metric there would always read 0
+        _config['count_rows'] = db.engine.dialect.name != 'sqlite'
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+
+    # counters are per process; with several gunicorn workers each scrape sees one worker
+    app.add_url_rule('/metrics', endpoint='metrics',
+                     view_func=lambda: Response(render_metrics(), mimetype='text/plain; version=0.0.4'))
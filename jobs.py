@@ -0,0 +1,249 @@
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from models import db, Job
+from checkpoints import build_checkpoints
+from importer import import_movements, read_records
+from queries import as_of_rows, movement_query, parse_as_of, report_query
+from stock import rebuild_balances
+import exporter
+
+log = logging.getLogger('inventory.jobs')
+
+JOB_EXECUTOR = os.environ.get('JOB_EXECUTOR', 'process')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+PROGRESS_INTERVAL = 1.0
+EXPORT_FORMATS = ('csv', 'jsonl')
+MAX_STORED_ERRORS = 1000
+
+_executor = {}
+_executor_lock = threading.Lock()
+
+
+def job_dir():
+    path = os.environ.get('JOB_DIR') or os.path.join(current_app.instance_path, 'jobs')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _pool():
+    # one pool per gunicorn worker, started on first use; spawned processes don't
+    # inherit the parent's open database connections
+    with _executor_lock:
+        if 'pool' not in _executor:
+            if JOB_EXECUTOR == 'thread':
+                _executor['pool'] = ThreadPoolExecutor(JOB_WORKERS, thread_name_prefix='job')
+            else:
+                _executor['pool'] = ProcessPoolExecutor(JOB_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _executor['pool']
+
+
+def _check_params(kind, params):
+    if kind not in JOB_KINDS:
+        raise ValueError(f'unknown job kind {kind!r}')
+    if kind in ('export-report', 'export-movements') and params.get('fmt', 'csv') not in EXPORT_FORMATS:
+        raise ValueError('fmt must be csv or jsonl')
+    try:
+        # bad dates fail the submit instead of the job
+        if kind == 'export-report' and params.get('as_of'):
+            parse_as_of(params['as_of'])
+        if kind == 'export-movements':
+            movement_query(params)
+    except ValueError:
+        raise ValueError('invalid date or cursor')
+    if kind == 'import' and params.get('fmt') not in EXPORT_FORMATS:
+        raise ValueError('fmt must be csv or jsonl')
+    if kind == 'build-checkpoints':
+        try:
+            # str() first so 1.5 and true are refused rather than truncated to 1
+            every_days = int(str(params.get('every_days', 1)))
+        except ValueError:
+            every_days = 0
+        if every_days < 1:
+            raise ValueError('every_days must be a whole number of at least 1')
+        params['every_days'] = every_days
+
+
+def submit(kind, params=None, upload=None):
+    """Queue a job and return it; upload is a file object saved for the job to read."""
+    params = dict(params or {})
+    _check_params(kind, params)
+    job = Job(id=uuid.uuid4().hex, kind=kind, status='queued')
+    if kind == 'import':
+        if upload is None:
+            raise ValueError('an import needs a file')
+        params['path'] = os.path.join(job_dir(), f'{job.id}.upload')
+        upload.save(params['path'])
+    job.params = json.dumps(params)
+    db.session.add(job)
+    # the job row must be visible to the pool before it starts
+    db.session.commit()
+
+    if JOB_EXECUTOR == 'thread':
+        future = _pool().submit(_run_in_app, current_app._get_current_object(), job.id)
+    else:
+        future = _pool().submit(run_job, job.id)
+    future.add_done_callback(_log_crash)
+    return job
+
+
+def _log_crash(future):
+    # failures inside a job are recorded on its row; this catches the pool itself breaking
+    if not future.cancelled() and future.exception() is not None:
+        log.error('background job crashed', exc_info=future.exception())
+
+
+def run_job(job_id):
+    # entry point in pool processes, which build their own app
+    from app import app
+    _run_in_app(app, job_id)
+
+
+def _set(job_id, only_if_status=None, **values):
+    # job rows are written in their own short transactions, apart from whatever the job is doing
+    table = Job.__table__
+    stmt = update(table).where(table.c.id == job_id).values(**values)
+    if only_if_status:
+        stmt = stmt.where(table.c.status == only_if_status)
+    with db.engine.begin() as conn:
+        return conn.execute(stmt).rowcount
+
+
+def _run_in_app(app, job_id):
+    with app.app_context():
+        # claiming the row makes sure a job only ever runs once
+        if not _set(job_id, only_if_status='queued', status='running', started_at=datetime.utcnow()):
+            return
+        job = db.session.get(Job, job_id)
+        try:
+            result, result_file = JOB_KINDS[job.kind](job, json.loads(job.params))
+            db.session.commit()
+        except Exception as e:
+            log.exception('job %s (%s) failed', job_id, job.kind)
+            db.session.rollback()
+            _set(job_id, status='failed', error=str(e) or type(e).__name__, finished_at=datetime.utcnow())
+        else:
+            _set(job_id, status='done', result=json.dumps(result), result_file=result_file,
+                 finished_at=datetime.utcnow())
+        finally:
+            db.session.remove()
+
+
+class Progress:
+    """Writes a job's row count at most once per PROGRESS_INTERVAL, outside the job's own transaction."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.written_at = 0.0
+
+    def update(self, done, force=True):
+        now = time.monotonic()
+        if not force and now - self.written_at < PROGRESS_INTERVAL:
+            return
+        self.written_at = now
+        try:
+            _set(self.job_id, progress=done)
+        except OperationalError:
+            # progress is best effort; a busy SQLite file shouldn't fail the job
+            log.warning('could not record progress for job %s', self.job_id)
+
+    def count(self, records):
+        done = 0
+        for done, rec in enumerate(records, 1):
+            self.update(done, force=False)
+            yield rec
+        self.update(done)
+
+
+def _write(job, chunks, fmt):
+    name = f'{job.id}.{fmt}'
+    path = os.path.join(job_dir(), name)
+    with open(path, 'w', encoding='utf-8', newline='') as fh:
+        for chunk in chunks:
+            fh.write(chunk)
+    return name
+
+
+def _export_report(job, params):
+    fmt = params.get('fmt', 'csv')
+    if params.get('as_of'):
+        rows = as_of_rows(parse_as_of(params['as_of']))
+    else:
+        rows = report_query().yield_per(exporter.FETCH_SIZE)
+    records = exporter.report_records(rows)
+    progress = Progress(job.id)
+    records = progress.count(records)
+    return {'fmt': fmt}, _write(job, exporter.render(records, fmt, exporter.REPORT_FIELDS), fmt)
+
+
+def _export_movements(job, params):
+    fmt = params.get('fmt', 'csv')
+    progress = Progress(job.id)
+    records = progress.count(exporter.movement_records(movement_query(params)))
+    return {'fmt': fmt}, _write(job, exporter.render(records, fmt, exporter.MOVEMENT_FIELDS), fmt)
+
+
+def _import(job, params):
+    progress = Progress(job.id)
+    try:
+        with open(params['path'], encoding='utf-8-sig', newline='') as fh:
+            result = import_movements(read_records(fh, params['fmt']), progress=progress.update)
+    finally:
+        os.remove(params['path'])
+    result['error_count'] = len(result['errors'])
+    result['errors'] = result['errors'][:MAX_STORED_ERRORS]
+    return result, None
+
+
+def _rebuild_balances(job, params):
+    return {'balances': rebuild_balances()}, None
+
+
+def _build_checkpoints(job, params):
+    return {'checkpoints': build_checkpoints(every=timedelta(days=params.get('every_days', 1)))}, None
+
+
+# kind -> fn(job, params) returning (result dict, result file name or None)
+JOB_KINDS = {
+    'export-report': _export_report,
+    'export-movements': _export_movements,
+    'import': _import,
+    'rebuild-balances': _rebuild_balances,
+    'build-checkpoints': _build_checkpoints,
+}
+
+
+def result_path(job):
+    return os.path.join(job_dir(), job.result_file) if job.result_file else None
+
+
+def prune_jobs(keep_days=7, stale_hours=24, now=None):
+    """Delete finished jobs (and their files) older than keep_days; fail jobs stuck for stale_hours.
+
+    A job is only ever stuck when the process running it died. Returns (deleted, failed).
+    """
+    now = now or datetime.utcnow()
+    stuck = Job.query.filter(Job.status.in_(('queued', 'running')),
+                             Job.created_at < now - timedelta(hours=stale_hours)).all()
+    for job in stuck:
+        job.status = 'failed'
+        job.error = 'abandoned: the process running it stopped'
+        job.finished_at = now
+    old = Job.query.filter(Job.status.in_(('done', 'failed')),
+                           Job.created_at < now - timedelta(days=keep_days)).all()
+    for job in old:
+        for path in (result_path(job), json.loads(job.params).get('path')):
+            if path and os.path.exists(path):
+                os.remove(path)
+        db.session.delete(job)
+    db.session.commit()
+    return len(old), len(stuck)
@@ -0,0 +1,139 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from models import db, Product, Location
+
+LOOKUP_MODELS = {'product': Product, 'location': Location}
+LOOKUP_CACHE_SIZE = int(os.environ.get('LOOKUP_CACHE_SIZE', 10000))
+LOOKUP_CACHE_TTL = float(os.environ.get('LOOKUP_CACHE_TTL', 30.0))
+# catalogs larger than this are picked with type-ahead instead of a <select>
+LOOKUP_OPTIONS_LIMIT = int(os.environ.get('LOOKUP_OPTIONS_LIMIT', 500))
+SEARCH_LIMIT = 20
+
+_lock = threading.Lock()
+# (kind, key) -> (stored_at, value), least recently used first
+_cache = OrderedDict()
+
+
+def _kind(model):
+    return model.__tablename__
+
+
+def _get(key):
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= LOOKUP_CACHE_TTL:
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return entry[1]
+
+
+def _put(key, value):
+    with _lock:
+        _cache[key] = (time.monotonic(), value)
+        _cache.move_to_end(key)
+        while len(_cache) > LOOKUP_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return value
+
+
+def invalidate(*kinds):
+    """Drop cached lookups for the given kinds ('product', 'location'), or all of them."""
+    with _lock:
+        for key in list(_cache):
+            if not kinds or key[0] in kinds:
+                del _cache[key]
+
+
+def lookup_options(model):
+    """[(id, name)] ordered by name for a form <select>, or None when the catalog is too big."""
+    key = (_kind(model), 'options')
+    options = _get(key)
+    if options is None:
+        rows = (db.session.query(model.id, model.name).order_by(model.name)
+                .limit(LOOKUP_OPTIONS_LIMIT + 1).all())
+        # False caches the "too many" answer too
+        options = _put(key, tuple(rows) if len(rows) <= LOOKUP_OPTIONS_LIMIT else False)
+    return list(options) if options is not False else None
+
+
+def name_to_id(model, name):
+    """Id of the row with this exact name, or None. Only hits are cached."""
+    key = (_kind(model), 'id', name)
+    row_id = _get(key)
+    if row_id is None:
+        row_id = db.session.query(model.id).filter(model.name == name).scalar()
+        if row_id is not None:
+            _put(key, row_id)
+    return row_id
+
+
+def resolve_id(model, value):
+    """Form input that is either an id or an exact name -> id; None when blank."""
+    value = (value or '').strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    row_id = name_to_id(model, value)
+    if row_id is None:
+        raise ValueError(f'unknown {_kind(model)} {value!r}')
+    return row_id
+
+
+def search_names(model, prefix, limit=SEARCH_LIMIT):
+    """[(id, name)] whose name starts with prefix, in name order.
+
+    The range bounds let the name index seek straight to the prefix; startswith
+    keeps the match exact. Matching is case-sensitive, like the index.
+    """
+    limit = max(1, min(limit, 100))
+    key = (_kind(model), 'search', prefix, limit)
+    rows = _get(key)
+    if rows is None:
+        rows = _put(key, tuple(
+            db.session.query(model.id, model.name)
+            .filter(model.name >= prefix, model.name < prefix + '\uffff',
+                    model.name.startswith(prefix, autoescape=True))
+            .order_by(model.name).limit(limit)))
+    return list(rows)
+
+
+def mark_lookups_changed(*models):
+    # for writers that bypass the ORM unit of work (bulk Core inserts)
+    db.session.info.setdefault('lookups_changed', set()).update(_kind(m) for m in models)
+
+
+def _renamed_or_added(session):
+    models = tuple(LOOKUP_MODELS.values())
+    changed = [obj for obj in itertools.chain(session.new, session.deleted) if isinstance(obj, models)]
+    changed += [obj for obj in session.dirty
+                if isinstance(obj, models) and inspect(obj).attrs.name.history.has_changes()]
+    return {_kind(type(obj)) for obj in changed}
+
+
+@event.listens_for(Session, 'before_flush')
+def _note_lookup_changes(session, flush_context, instances):
+    kinds = _renamed_or_added(session)
+    if kinds:
+        session.info.setdefault('lookups_changed', set()).update(kinds)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_lookups(session):
+    # other workers keep their copies until LOOKUP_CACHE_TTL runs out
+    kinds = session.info.pop('lookups_changed', None)
+    if kinds:
+        invalidate(*kinds)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_lookup_changes(session):
+    session.info.pop('lookups_changed', None)
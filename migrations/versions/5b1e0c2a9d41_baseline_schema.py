@@ -0,0 +1,120 @@
+"""baseline schema
+
+Revision ID: 5b1e0c2a9d41
+Revises: 
+Create Date: 2026-10-17 09:12:44.215380
+
+Databases created before migrations existed were built by db.create_all()
+and patched with ALTER TABLE at startup, so every step here checks what is
+already there. Existing installs can simply run `flask db upgrade`.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e0c2a9d41'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = inspector.get_table_names()
+
+    if 'location' not in tables:
+        op.create_table('location',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=120), nullable=False),
+            sa.Column('address', sa.String(length=250), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if 'product' not in tables:
+        op.create_table('product',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=120), nullable=False),
+            sa.Column('description', sa.String(length=250), nullable=True),
+            sa.Column('quantity', sa.Integer(), server_default='0', nullable=False),
+            sa.Column('location_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['location_id'], ['location.id'], ),
+            sa.PrimaryKeyConstraint('id')
+        )
+    else:
+        # the columns the old startup check used to ALTER in
+        existing = [c['name'] for c in inspector.get_columns('product')]
+        with op.batch_alter_table('product') as batch_op:
+            if 'quantity' not in existing:
+                batch_op.add_column(sa.Column('quantity', sa.Integer(), server_default='0', nullable=False))
+            if 'location_id' not in existing:
+                batch_op.add_column(sa.Column('location_id', sa.Integer(), nullable=True))
+
+    if 'product_movement' not in tables:
+        op.create_table('product_movement',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('timestamp', sa.DateTime(), nullable=False),
+            sa.Column('from_location', sa.Integer(), nullable=True),
+            sa.Column('to_location', sa.Integer(), nullable=True),
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.Column('qty', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['from_location'], ['location.id'], ),
+            sa.ForeignKeyConstraint(['product_id'], ['product.id'], ),
+            sa.ForeignKeyConstraint(['to_location'], ['location.id'], ),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if 'stock_balance' not in tables:
+        op.create_table('stock_balance',
+            sa.Column('product_id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('location_id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('qty', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('product_id', 'location_id')
+        )
+        # seed from the ledger, the same fold stock.replay_balances() does
+        op.execute("""
+            INSERT INTO stock_balance (product_id, location_id, qty)
+            SELECT product_id, location_id, SUM(qty) FROM (
+                SELECT id AS product_id, location_id, quantity AS qty
+                  FROM product WHERE location_id IS NOT NULL AND location_id != 0
+                UNION ALL
+                SELECT product_id, to_location, qty
+                  FROM product_movement WHERE to_location IS NOT NULL AND to_location != 0
+                UNION ALL
+                SELECT product_id, from_location, -qty
+                  FROM product_movement WHERE from_location IS NOT NULL AND from_location != 0
+            ) AS ledger
+            GROUP BY product_id, location_id
+            HAVING SUM(qty) != 0
+        """)
+
+    if 'stock_checkpoint' not in tables:
+        op.create_table('stock_checkpoint',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('taken_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+        with op.batch_alter_table('stock_checkpoint') as batch_op:
+            batch_op.create_index(batch_op.f('ix_stock_checkpoint_taken_at'), ['taken_at'], unique=True)
+
+    if 'stock_checkpoint_balance' not in tables:
+        op.create_table('stock_checkpoint_balance',
+            sa.Column('checkpoint_id', sa.Integer(), nullable=False),
+            sa.Column('product_id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('location_id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('qty', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['checkpoint_id'], ['stock_checkpoint.id'], ),
+            sa.PrimaryKeyConstraint('checkpoint_id', 'product_id', 'location_id')
+        )
+
+
+def downgrade():
+    op.drop_table('stock_checkpoint_balance')
+    with op.batch_alter_table('stock_checkpoint') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stock_checkpoint_taken_at'))
+    op.drop_table('stock_checkpoint')
+    op.drop_table('stock_balance')
+    op.drop_table('product_movement')
+    op.drop_table('product')
+    op.drop_table('location')
@@ -0,0 +1,44 @@
+"""background job table
+
+Revision ID: 6f3b9a1c7e52
+Revises: d2a8e61f4b07
+Create Date: 2026-10-17 16:42:10.503219
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f3b9a1c7e52'
+down_revision = 'd2a8e61f4b07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('kind', sa.String(length=40), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('params', sa.Text(), nullable=False),
+        sa.Column('progress', sa.Integer(), nullable=False),
+        sa.Column('result', sa.Text(), nullable=True),
+        sa.Column('result_file', sa.String(length=255), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_job_created_at'), ['created_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_job_status'), ['status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_job_status'))
+        batch_op.drop_index(batch_op.f('ix_job_created_at'))
+
+    op.drop_table('job')
@@ -0,0 +1,58 @@
+"""movement and name indexes
+
+Revision ID: 9c4d7f3e2a10
+Revises: 5b1e0c2a9d41
+Create Date: 2026-10-17 09:31:07.582913
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4d7f3e2a10'
+down_revision = '5b1e0c2a9d41'
+branch_labels = None
+depends_on = None
+
+
+def _dedupe_names(table):
+    # names were never unique; keep the oldest row's name and suffix the rest with their id
+    if op.get_bind().dialect.name == 'mysql':
+        renamed = "CONCAT(name, ' (', id, ')')"
+    else:
+        renamed = "name || ' (' || id || ')'"
+    op.execute(f"""
+        UPDATE {table} SET name = {renamed}
+        WHERE id NOT IN (SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM {table} GROUP BY name) AS firsts)
+    """)
+
+
+def upgrade():
+    _dedupe_names('product')
+    _dedupe_names('location')
+
+    with op.batch_alter_table('product') as batch_op:
+        batch_op.create_index(batch_op.f('ix_product_name'), ['name'], unique=True)
+
+    with op.batch_alter_table('location') as batch_op:
+        batch_op.create_index(batch_op.f('ix_location_name'), ['name'], unique=True)
+
+    with op.batch_alter_table('product_movement') as batch_op:
+        batch_op.create_index('ix_product_movement_timestamp_id', ['timestamp', 'id'], unique=False)
+        batch_op.create_index('ix_product_movement_product_timestamp', ['product_id', 'timestamp'], unique=False)
+        batch_op.create_index('ix_product_movement_to_product', ['to_location', 'product_id'], unique=False)
+        batch_op.create_index('ix_product_movement_from_product', ['from_location', 'product_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('product_movement') as batch_op:
+        batch_op.drop_index('ix_product_movement_from_product')
+        batch_op.drop_index('ix_product_movement_to_product')
+        batch_op.drop_index('ix_product_movement_product_timestamp')
+        batch_op.drop_index('ix_product_movement_timestamp_id')
+
+    with op.batch_alter_table('location') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_location_name'))
+
+    with op.batch_alter_table('product') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_name'))
@@ -0,0 +1,29 @@
+"""ledger version counter
+
+Revision ID: d2a8e61f4b07
+Revises: 9c4d7f3e2a10
+Create Date: 2026-10-17 14:05:52.118064
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a8e61f4b07'
+down_revision = '9c4d7f3e2a10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    ledger_version = op.create_table('ledger_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(ledger_version, [{'id': 1, 'version': 0}])
+
+
+def downgrade():
+    op.drop_table('ledger_version')
@@ -7,7 +7,7 @@ db = SQLAlchemy()
 class Product(db.Model):
     __tablename__ = 'product'
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), nullable=False)
+    name = db.Column(db.String(120), nullable=False, unique=True, index=True)
     description = db.Column(db.String(250))
     quantity = db.Column(db.Integer, default=0, nullable=False)
     location_id = db.Column(db.Integer, db.ForeignKey('location.id'), nullable=True)
@@ -18,7 +18,7 @@ class Product(db.Model):
 class Location(db.Model):
     __tablename__ = 'location'
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(120), nullable=False)
+    name = db.Column(db.String(120), nullable=False, unique=True, index=True)
     address = db.Column(db.String(250))
     
     products = db.relationship('Product', backref='location', lazy='dynamic')
@@ -28,6 +28,13 @@ class Location(db.Model):
 
 class ProductMovement(db.Model):
     __tablename__ = 'product_movement'
+    __table_args__ = (
+        # ledger paging (newest first) and as-of range scans
+        db.Index('ix_product_movement_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_product_movement_product_timestamp', 'product_id', 'timestamp'),
+        db.Index('ix_product_movement_to_product', 'to_location', 'product_id'),
+        db.Index('ix_product_movement_from_product', 'from_location', 'product_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     from_location = db.Column(db.Integer, db.ForeignKey('location.id'), nullable=True)
@@ -37,3 +44,61 @@ class ProductMovement(db.Model):
 
     def __repr__(self):
         return f"<Movement {self.id} P:{self.product_id} {self.from_location}->{self.to_location} Q:{self.qty}>"
+
+class StockBalance(db.Model):
+    __tablename__ = 'stock_balance'
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    location_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    qty = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<StockBalance P:{self.product_id} L:{self.location_id} Q:{self.qty}>"
+
+class StockCheckpoint(db.Model):
+    __tablename__ = 'stock_checkpoint'
+    id = db.Column(db.Integer, primary_key=True)
+    # movement totals for everything timestamped before taken_at
+    taken_at = db.Column(db.DateTime, nullable=False, unique=True, index=True)
+    balances = db.relationship('StockCheckpointBalance', backref='checkpoint', lazy='dynamic',
+                               cascade='all, delete-orphan')
+
+    def __repr__(self):
+        return f"<StockCheckpoint {self.id} {self.taken_at}>"
+
+class StockCheckpointBalance(db.Model):
+    __tablename__ = 'stock_checkpoint_balance'
+    checkpoint_id = db.Column(db.Integer, db.ForeignKey('stock_checkpoint.id'), primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    location_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    qty = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<StockCheckpointBalance C:{self.checkpoint_id} P:{self.product_id} L:{self.location_id} Q:{self.qty}>"
+
+class LedgerVersion(db.Model):
+    __tablename__ = 'ledger_version'
+    # single row, bumped by every commit that touches products, locations or stock
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<LedgerVersion {self.version}>"
+
+class Job(db.Model):
+    __tablename__ = 'job'
+    # random hex id, so result links can't be guessed
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(40), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued', index=True)
+    params = db.Column(db.Text, nullable=False, default='{}')
+    # rows processed so far
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    result = db.Column(db.Text)
+    result_file = db.Column(db.String(255))
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} {self.status}>"
@@ -0,0 +1,285 @@
+import os
+import random
+import time
+from functools import wraps
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError, OperationalError
+from models import db, Product, Location, ProductMovement, StockBalance
+from stock import apply_deltas, apply_product
+from checkpoints import shift_checkpoints
+
+WRITE_RETRIES = int(os.environ.get('MOVEMENT_WRITE_RETRIES', 5))
+RETRY_BACKOFF = float(os.environ.get('MOVEMENT_RETRY_BACKOFF', 0.05))
+ALLOW_NEGATIVE_STOCK = os.environ.get('ALLOW_NEGATIVE_STOCK', '0') == '1'
+
+# lock timeouts, deadlocks, serialization failures and lost insert races, across
+# SQLite, PostgreSQL and MySQL
+CONTENTION_ERRORS = ('database is locked', 'deadlock', 'lock wait timeout', 'could not serialize',
+                     'unique constraint', 'duplicate')
+
+
+class InsufficientStock(ValueError):
+    def __init__(self, product_id, location_id, available, qty):
+        self.product_id = product_id
+        self.location_id = location_id
+        self.available = available
+        super().__init__(f'only {available} available at location {location_id}, cannot move {qty}')
+
+
+def _is_contention(exc):
+    message = str(exc.orig).lower()
+    return any(text in message for text in CONTENTION_ERRORS)
+
+
+def write_transaction(fn):
+    """Run fn in its own transaction that locks before reading, commit it, and retry on contention.
+
+    Any transaction the request already has open is committed first, so objects
+    loaded before the call are reloaded inside the lock.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(WRITE_RETRIES + 1):
+            db.session.commit()
+            try:
+                # BEGIN IMMEDIATE on SQLite; networked databases lock rows with FOR UPDATE instead
+                db.session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
+                result = fn(*args, **kwargs)
+                db.session.commit()
+                return result
+            except (IntegrityError, OperationalError) as e:
+                db.session.rollback()
+                if attempt == WRITE_RETRIES or not _is_contention(e):
+                    raise
+                time.sleep(RETRY_BACKOFF * (2 ** attempt) * random.random())
+            except Exception:
+                db.session.rollback()
+                raise
+    return wrapper
+
+
+def get_or_create(model, name):
+    # the unique name index settles races: the loser's insert fails and it reads the winner's row
+    row_id = db.session.query(model.id).filter(model.name == name).scalar()
+    if row_id is not None:
+        return row_id
+    try:
+        with db.session.begin_nested():
+            row = model(name=name)
+            db.session.add(row)
+        return row.id
+    except IntegrityError:
+        return db.session.query(model.id).filter(model.name == name).scalar()
+
+
+def _ref(model, value):
+    # form input: blank, the id of an existing row, or a name that is created when it doesn't exist yet
+    value = (value or '').strip()
+    if not value:
+        return None
+    if value.isdigit():
+        if db.session.query(model.id).filter(model.id == int(value)).scalar() is None:
+            raise ValueError(f'unknown {model.__tablename__} id {value}')
+        return int(value)
+    return get_or_create(model, value)
+
+
+def _deltas(moves):
+    # moves: [(product_id, from_location, to_location, qty, sign)]
+    deltas = {}
+    for pid, from_loc, to_loc, qty, sign in moves:
+        for lid, delta in ((from_loc, -sign * qty), (to_loc, sign * qty)):
+            if lid:
+                deltas[(pid, lid)] = deltas.get((pid, lid), 0) + delta
+    return {key: delta for key, delta in deltas.items() if delta}
+
+
+def _lock_balances(keys, chunk_size=500):
+    # same lock order in every writer, so two of them can't deadlock on each other
+    keys = sorted(keys)
+    available = {}
+    for start in range(0, len(keys), chunk_size):
+        rows = (db.session.query(StockBalance.product_id, StockBalance.location_id, StockBalance.qty)
+                .filter(tuple_(StockBalance.product_id, StockBalance.location_id)
+                        .in_(keys[start:start + chunk_size]))
+                .order_by(StockBalance.product_id, StockBalance.location_id)
+                .with_for_update())
+        available.update(((pid, lid), qty) for pid, lid, qty in rows)
+    return available
+
+
+def _short(deltas, available):
+    # the first balance these deltas would take below zero, as (key, shortfall)
+    for key, delta in deltas.items():
+        if delta < 0 and not ALLOW_NEGATIVE_STOCK and available.get(key, 0) + delta < 0:
+            return key, -delta
+    return None
+
+
+def apply_checked(moves, skip_refused=False):
+    """Apply movement deltas under row locks; refuse to take any balance below zero.
+
+    With skip_refused, moves are checked one after another and the ones that would
+    go below zero are left out instead of raising; returns them as [(index, error)].
+    """
+    deltas = _deltas(moves)
+    available = _lock_balances(deltas)
+    if not skip_refused:
+        short = _short(deltas, available)
+        if short:
+            (pid, lid), qty = short
+            raise InsufficientStock(pid, lid, available.get((pid, lid), 0), qty)
+        apply_deltas(deltas)
+        return []
+
+    refused = []
+    kept = []
+    for i, move in enumerate(moves):
+        move_deltas = _deltas([move])
+        short = _short(move_deltas, available)
+        if short:
+            (pid, lid), qty = short
+            refused.append((i, str(InsufficientStock(pid, lid, available.get((pid, lid), 0), qty))))
+            continue
+        for key, delta in move_deltas.items():
+            available[key] = available.get(key, 0) + delta
+        kept.append(move)
+    apply_deltas(_deltas(kept))
+    return refused
+
+
+def _move(m, sign):
+    return (m.product_id, m.from_location, m.to_location, m.qty, sign)
+
+
+def _dated(m, sign):
+    # the shape shift_checkpoints takes
+    return (m.timestamp, m.product_id, m.from_location, m.to_location, sign * m.qty)
+
+
+@write_transaction
+def record_movement(product, from_location, to_location, qty):
+    """Record a movement from form input (names or ids); returns it."""
+    m = ProductMovement(product_id=_ref(Product, product), from_location=_ref(Location, from_location),
+                        to_location=_ref(Location, to_location), qty=qty)
+    db.session.add(m)
+    db.session.flush()
+    apply_checked([_move(m, 1)])
+    shift_checkpoints([_dated(m, 1)])
+    return m
+
+
+@write_transaction
+def record_movements(batch):
+    """Record importer.parse_record() tuples all together, or none if any would oversell; returns them."""
+    refs = {}
+    # numeric ids are checked with one IN (...) per table rather than one query each
+    for model, values in ((Product, {p for p, _, _, _, _ in batch}),
+                          (Location, {l for _, f, t, _, _ in batch for l in (f, t)})):
+        ids = {int(v) for v in values if v and v.isdigit()}
+        found = {row_id for row_id, in db.session.query(model.id).filter(model.id.in_(ids))} if ids else set()
+        refs.update(((model, v), int(v)) for v in values if v and v.isdigit() and int(v) in found)
+
+    def ref(model, value):
+        if (model, value) not in refs:
+            refs[(model, value)] = _ref(model, value)
+        return refs[(model, value)]
+
+    created = []
+    for product, from_location, to_location, qty, timestamp in batch:
+        m = ProductMovement(product_id=ref(Product, product), from_location=ref(Location, from_location),
+                            to_location=ref(Location, to_location), qty=qty)
+        if timestamp is not None:
+            m.timestamp = timestamp
+        created.append(m)
+    db.session.add_all(created)
+    db.session.flush()
+    apply_checked([_move(m, 1) for m in created])
+    shift_checkpoints([_dated(m, 1) for m in created])
+    return created
+
+
+@write_transaction
+def update_movements(changes):
+    """changes: [(movement_id, {field: value})]; returns the updated movements, skipping missing ids."""
+    ids = [movement_id for movement_id, _ in changes]
+    rows = {m.id: m for m in ProductMovement.query.filter(ProductMovement.id.in_(ids))
+            .order_by(ProductMovement.id).with_for_update()}
+    moves = []
+    dated = []
+    updated = []
+    for movement_id, values in changes:
+        m = rows.get(movement_id)
+        if m is None:
+            continue
+        moves.append(_move(m, -1))
+        dated.append(_dated(m, -1))
+        for key, value in values.items():
+            setattr(m, key, value)
+        moves.append(_move(m, 1))
+        dated.append(_dated(m, 1))
+        updated.append(m)
+    apply_checked(moves)
+    shift_checkpoints(dated)
+    return updated
+
+
+@write_transaction
+def remove_movement(movement_id):
+    # deleting an inbound movement takes stock away again, so it is checked too
+    m = db.session.get(ProductMovement, movement_id, with_for_update=True)
+    if m is None:
+        return None
+    apply_checked([_move(m, -1)])
+    shift_checkpoints([_dated(m, -1)])
+    db.session.delete(m)
+    return m
+
+
+@write_transaction
+def save_products(changes):
+    """changes: [(product_id or None to create, {field: value})]; returns the saved products, skipping missing ids.
+
+    A product's quantity is opening stock at its location, so its balance moves with it.
+    """
+    ids = [product_id for product_id, _ in changes if product_id is not None]
+    rows = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).order_by(Product.id).with_for_update()}
+    saved = []
+    for product_id, values in changes:
+        if product_id is None:
+            p = Product()
+            db.session.add(p)
+        else:
+            p = rows.get(product_id)
+            if p is None:
+                continue
+            apply_product(p, -1)
+        for key, value in values.items():
+            setattr(p, key, value)
+        saved.append(p)
+    db.session.flush()
+    for p in saved:
+        apply_product(p)
+    return saved
+
+
+@write_transaction
+def remove_product(product_id):
+    p = db.session.get(Product, product_id, with_for_update=True)
+    if p is None:
+        return None
+    apply_product(p, -1)
+    db.session.delete(p)
+    return p
+
+
+@write_transaction
+def remove_location(location_id):
+    loc = db.session.get(Location, location_id, with_for_update=True)
+    if loc is None:
+        return None
+    # deleting the location detaches its products, so their opening stock leaves the balance
+    for p in loc.products:
+        apply_product(p, -1)
+    db.session.delete(loc)
+    return loc
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_, and_
+from sqlalchemy.orm import aliased
+from models import db, Product, Location, ProductMovement, StockBalance
+from checkpoints import balances_as_of
+
+NAME_CHUNK_SIZE = 500
+
+
+def _lookup_id(model, inp):
+    # filter inputs accept an id or an exact name; an unknown name matches nothing
+    inp = (inp or '').strip()
+    if not inp:
+        return None
+    if inp.isdigit():
+        return int(inp)
+    row = db.session.query(model.id).filter(model.name == inp).first()
+    return row[0] if row else -1
+
+
+def _parse_date(raw, end=False):
+    raw = (raw or '').strip()
+    if not raw:
+        return None
+    value = datetime.fromisoformat(raw)
+    # a bare date as the end of a range includes that whole day
+    if end and len(raw) == 10:
+        value += timedelta(days=1)
+    return value
+
+
+def encode_cursor(timestamp, mid):
+    return f"{timestamp.isoformat()}_{mid}"
+
+
+def decode_cursor(raw):
+    ts, _, mid = raw.rpartition('_')
+    return datetime.fromisoformat(ts), int(mid)
+
+
+def movement_query(args):
+    # newest first, with (timestamp, id) as a stable keyset for paging
+    from_loc = aliased(Location)
+    to_loc = aliased(Location)
+    q = (db.session.query(ProductMovement, Product.name, from_loc.name, to_loc.name)
+         .outerjoin(Product, Product.id == ProductMovement.product_id)
+         .outerjoin(from_loc, from_loc.id == ProductMovement.from_location)
+         .outerjoin(to_loc, to_loc.id == ProductMovement.to_location))
+
+    product_id = _lookup_id(Product, args.get('product'))
+    if product_id is not None:
+        q = q.filter(ProductMovement.product_id == product_id)
+    location_id = _lookup_id(Location, args.get('location'))
+    if location_id is not None:
+        q = q.filter(or_(ProductMovement.from_location == location_id,
+                         ProductMovement.to_location == location_id))
+    start = _parse_date(args.get('start'))
+    if start:
+        q = q.filter(ProductMovement.timestamp >= start)
+    end = _parse_date(args.get('end'), end=True)
+    if end:
+        q = q.filter(ProductMovement.timestamp < end)
+
+    cursor = args.get('cursor')
+    if cursor:
+        ts, mid = decode_cursor(cursor)
+        q = q.filter(or_(ProductMovement.timestamp < ts,
+                         and_(ProductMovement.timestamp == ts, ProductMovement.id < mid)))
+
+    return q.order_by(ProductMovement.timestamp.desc(), ProductMovement.id.desc())
+
+
+def report_query():
+    # balances are kept current by every write, so this is one indexed read
+    product_name = func.coalesce(Product.name, 'Unknown Product')
+    location_name = func.coalesce(Location.name, 'Unknown Location')
+    return (db.session.query(StockBalance.product_id, StockBalance.location_id,
+                             product_name, location_name, StockBalance.qty)
+            .outerjoin(Product, Product.id == StockBalance.product_id)
+            .outerjoin(Location, Location.id == StockBalance.location_id)
+            .filter(StockBalance.qty != 0)
+            .order_by(product_name, location_name))
+
+
+def names_by_id(model, ids):
+    """{id: name} for the ids that exist, one IN (...) per NAME_CHUNK_SIZE ids."""
+    ids = list(set(ids))
+    names = {}
+    for start in range(0, len(ids), NAME_CHUNK_SIZE):
+        names.update(db.session.query(model.id, model.name)
+                      .filter(model.id.in_(ids[start:start + NAME_CHUNK_SIZE])))
+    return names
+
+
+def as_of_rows(as_of):
+    """Non-zero balances at as_of, shaped and ordered like report_query() rows."""
+    balances = {key: qty for key, qty in balances_as_of(as_of).items() if qty != 0}
+    products = names_by_id(Product, [pid for pid, _ in balances])
+    locations = names_by_id(Location, [lid for _, lid in balances])
+    rows = [(pid, lid, products.get(pid, 'Unknown Product'), locations.get(lid, 'Unknown Location'), qty)
+            for (pid, lid), qty in balances.items()]
+    rows.sort(key=lambda r: (r[2], r[3], r[0], r[1]))
+    return rows
+
+
+def parse_as_of(raw):
+    value = datetime.fromisoformat(raw)
+    # a bare date means stock at the end of that day
+    if len(raw) == 10:
+        value += timedelta(days=1) - timedelta(microseconds=1)
+    return value
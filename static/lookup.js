@@ -0,0 +1,22 @@
+// type-ahead for inputs with data-lookup: fills their <datalist> from the name search API
+document.querySelectorAll('input[data-lookup]').forEach(function (input) {
+  var list = document.getElementById(input.getAttribute('list'));
+  var timer = null;
+  input.addEventListener('input', function () {
+    clearTimeout(timer);
+    var q = input.value.trim();
+    if (!q || /^\d+$/.test(q)) return;
+    timer = setTimeout(function () {
+      fetch(input.dataset.lookup + '?q=' + encodeURIComponent(q))
+        .then(function (resp) { return resp.json(); })
+        .then(function (data) {
+          list.innerHTML = '';
+          data.items.forEach(function (item) {
+            var option = document.createElement('option');
+            option.value = item.name;
+            list.appendChild(option);
+          });
+        });
+    }, 150);
+  });
+});
@@ -0,0 +1,181 @@
+import itertools
+import os
+import time
+from sqlalchemy import bindparam, event, insert, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import db, Product, Location, ProductMovement, StockBalance, LedgerVersion
+
+LEDGER_MODELS = (Product, Location, ProductMovement, StockBalance)
+LEDGER_VERSION_TTL = float(os.environ.get('LEDGER_VERSION_TTL', 2.0))
+
+_ledger_version = {'value': None, 'read_at': 0.0}
+
+
+def _add_qty(product_id, location_id, delta):
+    # qty = qty + delta in the database, so concurrent writers can't lose each other's updates
+    count = db.session.execute(
+        update(StockBalance)
+        .where(StockBalance.product_id == product_id, StockBalance.location_id == location_id)
+        .values(qty=StockBalance.qty + delta)
+        .execution_options(synchronize_session=False)).rowcount
+    row = db.session.identity_map.get(db.session.identity_key(StockBalance, (product_id, location_id)))
+    if row is not None:
+        # reload from the database rather than add to a value another writer may have changed
+        db.session.expire(row, ['qty'])
+    return count
+
+
+def apply_delta(product_id, location_id, delta):
+    # adds delta to the materialized (product, location) balance, inside the caller's transaction
+    if not location_id or not delta:
+        return
+    if _add_qty(product_id, location_id, delta):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(StockBalance(product_id=product_id, location_id=location_id, qty=delta))
+    except IntegrityError:
+        # another writer created the row first
+        _add_qty(product_id, location_id, delta)
+
+
+def apply_product(p, sign=1):
+    # a product's own quantity counts as opening stock at its location
+    apply_delta(p.id, p.location_id, sign * (p.quantity or 0))
+
+
+def replay_balances():
+    # full ledger fold, the way /report used to compute it on every request
+    balances = {}
+
+    products = db.session.query(Product.id, Product.location_id, Product.quantity).yield_per(10000)
+    for pid, lid, qty in products:
+        if lid:
+            key = (pid, lid)
+            balances[key] = balances.get(key, 0) + (qty or 0)
+
+    moves = db.session.query(
+        ProductMovement.product_id,
+        ProductMovement.from_location,
+        ProductMovement.to_location,
+        ProductMovement.qty,
+    ).yield_per(10000)
+    for pid, from_loc, to_loc, qty in moves:
+        if from_loc:
+            key = (pid, from_loc)
+            balances[key] = balances.get(key, 0) - qty
+        if to_loc:
+            key = (pid, to_loc)
+            balances[key] = balances.get(key, 0) + qty
+
+    return balances
+
+
+def diff_balances():
+    # returns [(product_id, location_id, expected, actual)] where the table disagrees with the ledger
+    expected = replay_balances()
+    actual = {(b.product_id, b.location_id): b.qty for b in StockBalance.query.all()}
+    mismatches = []
+    for key in sorted(set(expected) | set(actual)):
+        exp = expected.get(key, 0)
+        act = actual.get(key, 0)
+        if exp != act:
+            mismatches.append((key[0], key[1], exp, act))
+    return mismatches
+
+
+def rebuild_balances():
+    balances = replay_balances()
+    StockBalance.query.delete()
+    mark_ledger_changed()
+    db.session.bulk_insert_mappings(StockBalance, [
+        {'product_id': pid, 'location_id': lid, 'qty': qty}
+        for (pid, lid), qty in balances.items() if qty != 0
+    ])
+    db.session.commit()
+    return len(balances)
+
+
+_balance = StockBalance.__table__
+_ADD_QTY = (update(_balance)
+            .where(_balance.c.product_id == bindparam('pid'), _balance.c.location_id == bindparam('lid'))
+            .values(qty=_balance.c.qty + bindparam('delta')))
+
+
+def apply_deltas(deltas, chunk_size=500):
+    # batched apply_delta for bulk writers: {(product_id, location_id): delta}
+    deltas = {key: delta for key, delta in deltas.items() if key[1] and delta}
+    keys = list(deltas)
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        existing = set(db.session.query(StockBalance.product_id, StockBalance.location_id).filter(
+            tuple_(StockBalance.product_id, StockBalance.location_id).in_(chunk)))
+        updates = [{'pid': pid, 'lid': lid, 'delta': deltas[(pid, lid)]} for pid, lid in chunk
+                   if (pid, lid) in existing]
+        if updates:
+            db.session.connection().execute(_ADD_QTY, updates)
+        new = [key for key in chunk if key not in existing]
+        if new:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(StockBalance), [
+                        {'product_id': pid, 'location_id': lid, 'qty': deltas[(pid, lid)]} for pid, lid in new])
+            except IntegrityError:
+                for pid, lid in new:
+                    apply_delta(pid, lid, deltas[(pid, lid)])
+    # the Core update above bypasses the identity map
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, StockBalance):
+            db.session.expire(obj)
+
+
+def mark_ledger_changed():
+    # for writers that bypass the ORM unit of work (bulk Core inserts)
+    db.session.info['ledger_changed'] = True
+
+
+def _has_ledger_changes(session):
+    return any(isinstance(obj, LEDGER_MODELS)
+               for obj in itertools.chain(session.new, session.dirty, session.deleted))
+
+
+@event.listens_for(Session, 'before_flush')
+def _note_ledger_changes(session, flush_context, instances):
+    if _has_ledger_changes(session):
+        session.info['ledger_changed'] = True
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_ledger_version(session):
+    # runs before commit's own final flush, so look at pending objects too
+    if session.info.pop('ledger_changed', False) or _has_ledger_changes(session):
+        table = LedgerVersion.__table__
+        session.connection().execute(update(table).values(version=table.c.version + 1))
+        session.info['ledger_bumped'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _expire_ledger_version(session):
+    if session.info.pop('ledger_bumped', False):
+        _ledger_version['read_at'] = 0.0
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_ledger_changes(session):
+    session.info.pop('ledger_changed', None)
+    session.info.pop('ledger_bumped', None)
+
+
+def ledger_version():
+    """Current ledger version, re-read at most every LEDGER_VERSION_TTL seconds.
+
+    Commits in this process refresh it immediately; other workers' writes show up
+    within the TTL.
+    """
+    now = time.monotonic()
+    if _ledger_version['value'] is None or now - _ledger_version['read_at'] >= LEDGER_VERSION_TTL:
+        value = db.session.execute(select(LedgerVersion.version)).scalar()
+        _ledger_version['value'] = value or 0
+        _ledger_version['read_at'] = now
+    return _ledger_version['value']
@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+
+# the app reads DATABASE_URL when it is imported, so point it at a scratch file first
+_tmp = tempfile.mkdtemp(prefix='inventory-tests-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_tmp, "test.db")}'
+os.environ.setdefault('JOB_DIR', os.path.join(_tmp, 'jobs'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from flask_migrate import upgrade
+from sqlalchemy import event, text
+
+from app import app as flask_app
+from models import db
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        upgrade()
+        yield flask_app
+        db.session.remove()
+        # empty every table but keep the schema for the next test
+        with db.engine.begin() as conn:
+            for table in reversed(db.metadata.sorted_tables):
+                conn.execute(table.delete())
+            conn.execute(text('INSERT INTO ledger_version (id, version) VALUES (1, 0)'))
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def count_queries(app):
+    """Returns a function that runs a callable and gives back how many SQL statements it ran."""
+    def count(fn):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            fn()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        return len(statements)
+    return count
@@ -0,0 +1,65 @@
+from models import db, Product, Location, ProductMovement
+
+
+def test_unknown_product_location_is_a_batch_error(client):
+    db.session.add(Location(id=1, name='Dock'))
+    db.session.commit()
+
+    resp = client.post('/api/v1/products', json=[{'name': 'A', 'location_id': 1},
+                                                  {'name': 'B', 'location_id': 404}])
+    assert resp.status_code == 400
+    assert resp.get_json()['errors'] == [{'index': 1, 'error': 'unknown location id 404'}]
+    assert Product.query.count() == 0
+
+    created = client.post('/api/v1/products', json={'name': 'A', 'location_id': 1}).get_json()
+    resp = client.patch('/api/v1/products', json={'id': created['items'][0]['id'], 'location_id': 404})
+    assert resp.status_code == 400
+    assert resp.get_json()['errors'] == [{'index': 0, 'error': 'unknown location id 404'}]
+
+
+def test_unknown_movement_refs_are_checked_in_one_query_per_model(client, count_queries):
+    db.session.add_all([Product(id=1, name='A'), Location(id=1, name='Dock')])
+    db.session.add_all([ProductMovement(id=i, product_id=1, to_location=1, qty=1) for i in (1, 2, 3)])
+    db.session.commit()
+
+    items = [{'id': 1, 'product_id': 7}, {'id': 2, 'from_location': 8}, {'id': 3, 'to_location': 9}]
+    resp = None
+
+    def patch():
+        nonlocal resp
+        resp = client.patch('/api/v1/movements', json=items)
+    statements = count_queries(patch)
+
+    assert resp.status_code == 400
+    assert resp.get_json()['errors'] == [{'index': 0, 'error': 'unknown product id 7'},
+                                         {'index': 1, 'error': 'unknown location id 8'},
+                                         {'index': 2, 'error': 'unknown location id 9'}]
+    # loading the movements, then one IN (...) for products and one for locations
+    assert statements <= 4
+
+
+def test_posted_movements_are_stock_checked(client):
+    resp = client.post('/api/v1/movements', json=[{'product': 'Bolt', 'to_location': 'Dock', 'qty': 5},
+                                                   {'product': 'Bolt', 'from_location': 'Dock',
+                                                    'to_location': 'Yard', 'qty': 3}])
+    assert resp.status_code == 201
+    assert resp.get_json() == {'created': 2}
+    assert Product.query.filter_by(name='Bolt').count() == 1
+    assert Location.query.count() == 2
+
+    resp = client.post('/api/v1/movements', json=[{'product': 'Bolt', 'to_location': 'Dock', 'qty': 1},
+                                                   {'product': 'Bolt', 'from_location': 'Dock', 'qty': 4}])
+    assert resp.status_code == 409
+    assert resp.get_json()['location_id'] == Location.query.filter_by(name='Dock').one().id
+    # nothing from the refused batch is kept
+    assert ProductMovement.query.count() == 2
+    stock = {(b['product_id'], b['location_id']): b['qty'] for b in client.get('/api/v1/stock').get_json()['items']}
+    assert sorted(stock.values()) == [2, 3]
+
+
+def test_posted_movements_with_unknown_ids_are_rejected(client):
+    resp = client.post('/api/v1/movements', json=[{'product': 'Bolt', 'to_location': 'Dock', 'qty': 5},
+                                                   {'product': '999', 'to_location': 'Dock', 'qty': 1}])
+    assert resp.status_code == 400
+    assert resp.get_json()['errors'] == [{'index': 1, 'error': 'unknown product id 999'}]
+    assert ProductMovement.query.count() == 0
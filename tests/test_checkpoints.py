@@ -0,0 +1,89 @@
+import random
+from datetime import datetime, timedelta
+
+from checkpoints import balances_as_of, build_checkpoints, compact_checkpoints
+from models import db, Product, Location, ProductMovement, StockCheckpoint, StockCheckpointBalance
+from stock import rebuild_balances
+import movements
+
+
+def replay(as_of):
+    balances = {}
+    for m in ProductMovement.query.filter(ProductMovement.timestamp <= as_of):
+        for lid, delta in ((m.from_location, -m.qty), (m.to_location, m.qty)):
+            if lid:
+                balances[(m.product_id, lid)] = balances.get((m.product_id, lid), 0) + delta
+    for p in Product.query.filter(Product.location_id.isnot(None)):
+        balances[(p.id, p.location_id)] = balances.get((p.id, p.location_id), 0) + p.quantity
+    return {key: qty for key, qty in balances.items() if qty}
+
+
+def as_of(when):
+    return {key: qty for key, qty in balances_as_of(when).items() if qty}
+
+
+def taken_at():
+    return [cp.taken_at for cp in StockCheckpoint.query.order_by(StockCheckpoint.taken_at)]
+
+
+def test_checkpoints_land_on_boundaries_and_skip_idle_days(app):
+    db.session.add_all([Product(id=1, name='Bolt'), Location(id=1, name='Dock')])
+    db.session.add_all([ProductMovement(product_id=1, to_location=1, qty=qty, timestamp=ts) for ts, qty in (
+        (datetime(2025, 1, 1, 10), 1), (datetime(2025, 1, 1, 23), 2),
+        (datetime(2025, 1, 3, 5), 4), (datetime(2025, 1, 4), 8))])
+    db.session.commit()
+
+    assert build_checkpoints(until=datetime(2025, 1, 5, 12)) == 3
+    # nothing moved on the 2nd, so there is no checkpoint at the start of the 3rd
+    assert taken_at() == [datetime(2025, 1, 2), datetime(2025, 1, 4), datetime(2025, 1, 5)]
+    # a checkpoint holds what moved strictly before it
+    qty = {cp.taken_at.day: cp.balances.one().qty for cp in StockCheckpoint.query}
+    assert qty == {2: 3, 4: 7, 5: 15}
+    assert build_checkpoints(until=datetime(2025, 1, 5, 12)) == 0
+
+
+def test_compaction_keeps_recent_and_first_of_each_month(app):
+    days = [datetime(2025, 1, 1), datetime(2025, 1, 15), datetime(2025, 2, 3), datetime(2025, 2, 20),
+            datetime(2025, 5, 20), datetime(2025, 5, 25)]
+    for day in days:
+        cp = StockCheckpoint(taken_at=day)
+        db.session.add(cp)
+        db.session.flush()
+        db.session.add(StockCheckpointBalance(checkpoint_id=cp.id, product_id=1, location_id=1, qty=1))
+    db.session.commit()
+
+    assert compact_checkpoints(keep_days=30, now=datetime(2025, 6, 1)) == 2
+    assert taken_at() == [datetime(2025, 1, 1), datetime(2025, 2, 3), datetime(2025, 5, 20), datetime(2025, 5, 25)]
+    assert StockCheckpointBalance.query.count() == 4
+
+
+def test_as_of_matches_full_replay_through_back_dated_writes(app):
+    rng = random.Random(6)
+    start = datetime(2025, 1, 1)
+    db.session.add_all([Location(id=i, name=f'L{i}') for i in (1, 2, 3)])
+    db.session.add_all([Product(id=i, name=f'P{i}', quantity=i, location_id=1) for i in (1, 2, 3)])
+    db.session.add_all([ProductMovement(product_id=rng.randint(1, 3), from_location=rng.choice((None, 2)),
+                                        to_location=rng.choice((1, 3)), qty=rng.randint(1, 9),
+                                        timestamp=start + timedelta(hours=rng.randint(0, 24 * 20)))
+                        for _ in range(200)])
+    db.session.commit()
+    rebuild_balances()
+    assert build_checkpoints(until=start + timedelta(days=21)) > 10
+    checkpoints = taken_at()
+    samples = [start + timedelta(days=d, hours=h) for d in range(-1, 22, 3) for h in (0, 7)]
+
+    def check():
+        for when in samples:
+            assert as_of(when) == replay(when), when
+        # back-dated writes adjust checkpoints in place instead of dropping them
+        assert taken_at() == checkpoints
+
+    check()
+    old = ProductMovement.query.filter(ProductMovement.to_location == 3).order_by(ProductMovement.timestamp).first()
+    movements.update_movements([(old.id, {'to_location': 1, 'qty': old.qty + 2})])
+    check()
+    movements.remove_movement(old.id)
+    check()
+    movements.record_movements([('P2', None, 'L2', 5, start + timedelta(days=2, hours=3)),
+                                ('P9', None, 'L3', 4, start + timedelta(days=9))])
+    check()
@@ -0,0 +1,78 @@
+import io
+
+from sqlalchemy.exc import IntegrityError
+
+import importer
+from importer import import_movements, read_records
+from models import db, Location, Product, ProductMovement, StockBalance
+from stock import diff_balances
+
+
+def run_import(text):
+    return import_movements(read_records(io.StringIO(text), 'csv'))
+
+
+def test_unknown_ids_are_row_errors(app):
+    db.session.add(Location(id=1, name='Dock'))
+    db.session.commit()
+
+    result = run_import('product,from_location,to_location,qty\n'
+                        '999999,,1,5\n'
+                        'P,,88888,3\n'
+                        'P,,1,2\n'
+                        'P,,Yard,1\n')
+
+    assert result['imported'] == 2
+    assert result['errors'] == [(2, 'unknown product id 999999'), (3, 'unknown location id 88888')]
+    assert ProductMovement.query.count() == 2
+    keys = {(b.product_id, b.location_id) for b in StockBalance.query}
+    assert (999999, 1) not in keys
+    assert all(lid != 88888 for _, lid in keys)
+
+
+def test_existing_ids_are_checked_once_per_chunk(app, count_queries):
+    db.session.add(Location(id=1, name='Dock'))
+    db.session.commit()
+    rows = ''.join(f'P{i},,1,1\n' for i in range(50))
+
+    statements = count_queries(lambda: run_import('product,from_location,to_location,qty\n' + rows))
+
+    assert ProductMovement.query.count() == 50
+    # a constant number of statements, not one id lookup per row
+    assert statements < 20
+
+
+def test_rows_that_would_oversell_are_refused(app):
+    db.session.add_all([Location(id=1, name='Dock'), Location(id=2, name='Yard')])
+    db.session.commit()
+
+    result = run_import('product,from_location,to_location,qty\n'
+                        'Bolt,Dock,,7\n'
+                        'Bolt,,Dock,5\n'
+                        'Bolt,Dock,Yard,3\n'
+                        'Bolt,Dock,,3\n')
+
+    assert result['imported'] == 2
+    assert result['errors'] == [(2, 'only 0 available at location 1, cannot move 7'),
+                                (5, 'only 2 available at location 1, cannot move 3')]
+    assert StockBalance.query.filter(StockBalance.qty < 0).count() == 0
+    assert diff_balances() == []
+
+
+def test_a_name_race_retries_the_batch(app, monkeypatch):
+    real = importer._resolve_names
+    raised = []
+
+    def racing(model, names, cache):
+        real(model, names, cache)
+        if not raised:
+            # as if another writer inserted the same name first
+            raised.append(model)
+            raise IntegrityError('INSERT', {}, Exception('UNIQUE constraint failed: product.name'))
+    monkeypatch.setattr(importer, '_resolve_names', racing)
+
+    result = run_import('product,from_location,to_location,qty\nBolt,,Dock,5\nNut,,Dock,2\n')
+
+    assert raised and result['imported'] == 2
+    assert sorted(name for name, in db.session.query(Product.name)) == ['Bolt', 'Nut']
+    assert diff_balances() == []
@@ -0,0 +1,50 @@
+import re
+
+from flask import g
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import instrumentation
+from models import db, Location, Product, ProductMovement
+
+
+def metric(name, route):
+    text = instrumentation.render_metrics()
+    match = re.search(rf'^{name}{{route="{re.escape(route)}"}} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_streamed_exports_record_their_sql(client):
+    db.session.add_all([Location(id=1, name='Dock'), Product(id=1, name='Widget')])
+    db.session.add(ProductMovement(product_id=1, to_location=1, qty=3))
+    db.session.commit()
+    route = '/movements.<fmt>'
+    before = metric('inventory_db_statements_total', route)
+
+    resp = client.get('/movements.csv')
+    assert b'Widget' in resp.data
+    resp.close()
+
+    # the export query runs while the body streams, after the request hooks
+    assert metric('inventory_db_statements_total', route) > before
+    assert metric('inventory_request_duration_seconds_count', route) >= 1
+
+
+def test_no_row_metric_on_sqlite(client):
+    client.get('/report')
+    assert 'inventory_db_rows_total' not in instrumentation.render_metrics()
+
+
+def test_failed_statements_leave_nothing_on_the_connection(app):
+    with app.test_request_context('/report'):
+        app.preprocess_request()
+        # the pooled connection's info outlives the Connection wrapper
+        info = db.session.connection().info
+        for _ in range(3):
+            try:
+                db.session.execute(text('SELECT * FROM no_such_table'))
+            except OperationalError:
+                db.session.rollback()
+        db.session.execute(text('SELECT 1'))
+        assert not info.get('metrics_started')
+        assert g.metrics_db['statements'] >= 1
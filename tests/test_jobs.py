@@ -0,0 +1,52 @@
+import io
+from datetime import datetime
+
+import pytest
+
+import jobs
+from queries import as_of_rows
+from models import db, Product, Location, ProductMovement, Job
+
+
+@pytest.mark.parametrize('raw, expected', [(None, 1), (3, 3), ('7', 7)])
+def test_every_days_is_coerced(raw, expected):
+    params = {} if raw is None else {'every_days': raw}
+    jobs._check_params('build-checkpoints', params)
+    assert params['every_days'] == expected
+
+
+@pytest.mark.parametrize('raw', [0, -1, '0', 'x', '', 1.5, True, None])
+def test_bad_every_days_fails_the_submit(raw):
+    with pytest.raises(ValueError, match='every_days'):
+        jobs._check_params('build-checkpoints', {'every_days': raw})
+
+
+def test_as_of_rows_are_in_name_order(client):
+    # ids run the other way from names, so an id sort would give the reverse order
+    db.session.add_all([Product(id=1, name='Zinc'), Product(id=2, name='Bolt'),
+                        Location(id=1, name='Yard'), Location(id=2, name='Dock')])
+    db.session.add_all([ProductMovement(product_id=pid, to_location=lid, qty=1, timestamp=datetime(2025, 1, 1))
+                        for pid in (1, 2) for lid in (1, 2)])
+    db.session.commit()
+
+    rows = as_of_rows(datetime(2025, 1, 2))
+
+    assert [(product, location) for _, _, product, location, _ in rows] == [
+        ('Bolt', 'Dock'), ('Bolt', 'Yard'), ('Zinc', 'Dock'), ('Zinc', 'Yard')]
+    # the page is built from the same rows
+    page = client.get('/report?as_of=2025-01-01').get_data(as_text=True)
+    assert page.index('Bolt') < page.index('Zinc')
+
+
+def test_bad_job_requests_are_rejected(client):
+    for body in ([{'kind': 'rebuild-balances'}], {'kind': ['import']},
+                 {'kind': 'export-movements', 'params': {'product': 5}},
+                 {'kind': 'export-movements', 'params': ['fmt']}):
+        assert client.post('/api/v1/jobs', json=body).status_code == 400
+
+    resp = client.post('/movement/import', data={'file': (io.BytesIO(b'product,qty\n'), 'm.csv'),
+                                                  'format': 'xlsx', 'background': '1'})
+    assert resp.status_code == 302
+    with client.session_transaction() as session:
+        assert session['_flashes'][0][1] == 'Could not start the job: fmt must be csv or jsonl.'
+    assert Job.query.count() == 0
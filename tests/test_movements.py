@@ -0,0 +1,62 @@
+import io
+import random
+import threading
+
+from benchmarks import stress_movements
+from models import db, Location, Product, ProductMovement, StockBalance
+
+
+def flashes(client):
+    with client.session_transaction() as session:
+        return [message for _, message in session.pop('_flashes', [])]
+
+
+def test_form_ids_must_exist(client):
+    db.session.add(Location(id=1, name='Dock'))
+    db.session.commit()
+
+    client.post('/movement/add', data={'product': '999', 'to_location': '1', 'qty': '2'})
+    assert flashes(client) == ['Could not save: unknown product id 999.']
+    client.post('/movement/add', data={'product': 'Bolt', 'to_location': '888', 'qty': '2'})
+    assert flashes(client) == ['Could not save: unknown location id 888.']
+
+    assert ProductMovement.query.count() == 0
+    assert StockBalance.query.count() == 0
+    client.post('/movement/add', data={'product': 'Bolt', 'to_location': '1', 'qty': '2'})
+    assert ProductMovement.query.count() == 1
+
+
+def test_parallel_writers_cannot_oversell(app):
+    # a short in-process run of benchmarks.stress_movements, with API batches and imports mixed in
+    db.session.add_all([Location(id=i, name=f'Location {i}') for i in (1, 2, 3)])
+    db.session.add_all([Product(id=i, name=f'Product {i}', quantity=0) for i in (1, 2, 3)])
+    db.session.commit()
+    statuses = []
+
+    def writer(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        for _ in range(40):
+            data = stress_movements.random_movement(rng, 3, 3)
+            kind = rng.random()
+            if kind < 0.15:
+                resp = client.post('/api/v1/movements', json=[data, stress_movements.random_movement(rng, 3, 3)])
+            elif kind < 0.25:
+                rows = ''.join(f"{d['product']},{d.get('from_location', '')},{d['to_location']},{d['qty']}\n"
+                               for d in (data, stress_movements.random_movement(rng, 3, 3)))
+                upload = (io.BytesIO(('product,from_location,to_location,qty\n' + rows).encode()), 'm.csv')
+                resp = client.post('/movement/import', data={'file': upload})
+            else:
+                resp = client.post('/movement/add', data=data)
+            statuses.append(resp.status_code)
+
+    threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(statuses) == 160
+    assert all(status < 500 for status in statuses)
+    assert ProductMovement.query.count() > 0
+    assert stress_movements.problems() == []
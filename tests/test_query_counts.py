@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from models import db, Product, Location, ProductMovement
+from stock import rebuild_balances
+
+ROWS = 40
+
+
+def seed(rows):
+    db.session.execute(insert(Location.__table__),
+                       [{'id': i, 'name': f'Location {i}'} for i in range(1, rows + 1)])
+    db.session.execute(insert(Product.__table__),
+                       [{'id': i, 'name': f'Product {i}', 'quantity': 0} for i in range(1, rows + 1)])
+    start = datetime(2025, 1, 1)
+    db.session.execute(insert(ProductMovement.__table__), [
+        {'product_id': i, 'from_location': None, 'to_location': i, 'qty': 5,
+         'timestamp': start + timedelta(minutes=i)}
+        for i in range(1, rows + 1)
+    ])
+    db.session.commit()
+    rebuild_balances()
+
+
+def statements_for(client, count_queries, url):
+    client.get(url)  # warm up per-process caches
+    responses = []
+    n = count_queries(lambda: responses.append(client.get(url)))
+    assert responses[0].status_code == 200
+    return n, responses[0].data
+
+
+@pytest.mark.parametrize('url', ['/movements', '/report'])
+def test_statement_count_does_not_grow_with_rows(client, count_queries, url):
+    empty, _ = statements_for(client, count_queries, url)
+    seed(ROWS)
+    full, body = statements_for(client, count_queries, url)
+
+    # every seeded name is on the page, fetched without a query per row
+    assert f'Product {ROWS}'.encode() in body
+    assert f'Location {ROWS}'.encode() in body
+    assert full == empty
@@ -0,0 +1,39 @@
+from sqlalchemy import text
+
+from models import db, Product, Location, StockBalance
+from stock import apply_delta, apply_deltas, diff_balances
+
+
+def test_product_and_location_writes_keep_balances_in_step(client):
+    db.session.add_all([Location(id=1, name='Dock'), Location(id=2, name='Yard')])
+    db.session.commit()
+
+    created = client.post('/api/v1/products', json=[{'name': 'Bolt', 'quantity': 5, 'location_id': 1},
+                                                     {'name': 'Nut', 'quantity': 2, 'location_id': 2}])
+    bolt, nut = [p['id'] for p in created.get_json()['items']]
+    assert client.patch('/api/v1/products', json={'id': bolt, 'quantity': 8, 'location_id': 2}).status_code == 200
+    client.post('/api/v1/movements', json={'product': str(bolt), 'from_location': '2', 'to_location': '1', 'qty': 3})
+    client.post(f'/product/edit/{nut}', data={'name': 'Nut', 'quantity': '4', 'location': '1'})
+    client.post('/location/delete/2')
+
+    assert diff_balances() == []
+    assert db.session.get(StockBalance, (bolt, 1)).qty == 3
+    client.post(f'/product/delete/{nut}')
+    assert diff_balances() == []
+
+
+def test_balance_updates_add_in_the_database(app):
+    db.session.add_all([Product(id=1, name='Bolt'), Location(id=1, name='Dock'),
+                        StockBalance(product_id=1, location_id=1, qty=5)])
+    db.session.commit()
+
+    row = db.session.get(StockBalance, (1, 1))
+    # another writer's update that the loaded row hasn't seen
+    db.session.execute(text('UPDATE stock_balance SET qty = qty + 10'))
+    apply_delta(1, 1, 2)
+    apply_delta(1, 2, 4)
+    assert row.qty == 17
+    apply_deltas({(1, 1): -3, (1, 2): 1, (1, 3): 6})
+    db.session.commit()
+
+    assert {(b.location_id, b.qty) for b in StockBalance.query} == {(1, 14), (2, 5), (3, 6)}